@@ -10,11 +10,12 @@ class AdminAuth(AuthenticationBackend):
     async def authenticate(self, request: Request) -> bool:
         token = request.cookies.get('bonds')
         from auth.user_manager import is_admin_token, get_jwt_strategy
+        strategy = get_jwt_strategy()
         if not token or not is_admin_token(request,
                                            token,
-                                           get_jwt_strategy().secret,
-                                           get_jwt_strategy().token_audience,
-                                           get_jwt_strategy().algorithm):
+                                           strategy.secret,
+                                           strategy.token_audience,
+                                           [strategy.algorithm]):
             raise HTTPException(status_code=403, detail="Not authorized to administrate")
         return True
 
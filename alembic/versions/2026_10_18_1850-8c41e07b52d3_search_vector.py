@@ -0,0 +1,49 @@
+"""search vector
+
+Revision ID: 8c41e07b52d3
+Revises: 3f6d2a9c1b7e
+Create Date: 2026-10-18 18:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41e07b52d3'
+down_revision: Union[str, None] = '3f6d2a9c1b7e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # a stored generated column rewrites tasks once under an exclusive lock
+    op.add_column('tasks', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('simple', coalesce(headline, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(description, '')), 'B')",
+            persisted=True,
+        ),
+        nullable=True,
+    ))
+    # built without blocking writes, which CONCURRENTLY can't do inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_tasks_search_vector', 'tasks', ['search_vector'],
+            unique=False, postgresql_using='gin', postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_comments_search_vector', 'comments', [sa.text("to_tsvector('simple', text)")],
+            unique=False, postgresql_using='gin', postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_comments_search_vector', table_name='comments', postgresql_concurrently=True)
+        op.drop_index('ix_tasks_search_vector', table_name='tasks', postgresql_concurrently=True)
+    op.drop_column('tasks', 'search_vector')
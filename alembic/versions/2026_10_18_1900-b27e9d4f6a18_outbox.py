@@ -0,0 +1,42 @@
+"""outbox
+
+Revision ID: b27e9d4f6a18
+Revises: 8c41e07b52d3
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'b27e9d4f6a18'
+down_revision: Union[str, None] = '8c41e07b52d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('outboxmessages',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event', sa.Enum('created', 'commented', 'closed', 'uploaded', 'downloaded', name='notificationevent'), nullable=False),
+    sa.Column('task_id', sa.Integer(), nullable=True),
+    sa.Column('recipients', postgresql.ARRAY(sa.String()), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), server_default=sa.text("TIMEZONE('utc', now())"), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text("TIMEZONE('utc', now())"), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.Column('failed_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['task_id'], ['tasks.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outboxmessages_pending', 'outboxmessages', ['next_attempt_at'], unique=False, postgresql_where=sa.text('sent_at IS NULL AND failed_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outboxmessages_pending', table_name='outboxmessages', postgresql_where=sa.text('sent_at IS NULL AND failed_at IS NULL'))
+    op.drop_table('outboxmessages')
+    sa.Enum(name='notificationevent').drop(op.get_bind(), checkfirst=False)
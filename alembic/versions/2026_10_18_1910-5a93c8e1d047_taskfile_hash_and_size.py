@@ -0,0 +1,29 @@
+"""taskfile hash and size
+
+Revision ID: 5a93c8e1d047
+Revises: b27e9d4f6a18
+Create Date: 2026-10-18 19:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a93c8e1d047'
+down_revision: Union[str, None] = 'b27e9d4f6a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # NULL for files stored before hashing, until `python -m tasks.storage` fills them in
+    op.add_column('taskfiles', sa.Column('sha256', sa.String(length=64), nullable=True))
+    op.add_column('taskfiles', sa.Column('size', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('taskfiles', 'size')
+    op.drop_column('taskfiles', 'sha256')
@@ -0,0 +1,32 @@
+"""drop downloaded event
+
+Revision ID: e4b0f2c7a961
+Revises: 5a93c8e1d047
+Create Date: 2026-10-18 19:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from alembic_postgresql_enum import TableReference
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b0f2c7a961'
+down_revision: Union[str, None] = '5a93c8e1d047'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # downloads no longer notify anyone, so pending ones are dropped with the value
+    op.execute("DELETE FROM outboxmessages WHERE event = 'downloaded'")
+    op.sync_enum_values('public', 'notificationevent', ['created', 'commented', 'closed', 'uploaded'],
+                        [TableReference(table_schema='public', table_name='outboxmessages', column_name='event')],
+                        enum_values_to_rename=[])
+
+
+def downgrade() -> None:
+    op.sync_enum_values('public', 'notificationevent', ['created', 'commented', 'closed', 'uploaded', 'downloaded'],
+                        [TableReference(table_schema='public', table_name='outboxmessages', column_name='event')],
+                        enum_values_to_rename=[])
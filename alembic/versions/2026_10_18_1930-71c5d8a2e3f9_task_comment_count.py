@@ -0,0 +1,45 @@
+"""task comment count
+
+Revision ID: 71c5d8a2e3f9
+Revises: e4b0f2c7a961
+Create Date: 2026-10-18 19:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '71c5d8a2e3f9'
+down_revision: Union[str, None] = 'e4b0f2c7a961'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # both defaults are stable, so adding the columns doesn't rewrite tasks
+    op.add_column('tasks', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tasks', sa.Column('last_activity_at', sa.DateTime(), server_default=sa.text("TIMEZONE('utc', now())"), nullable=False))
+    op.execute(
+        "UPDATE tasks SET last_activity_at = created_at "
+        "WHERE NOT EXISTS (SELECT 1 FROM comments WHERE comments.task_id = tasks.id)"
+    )
+    op.execute(
+        "UPDATE tasks SET comment_count = c.count, last_activity_at = GREATEST(tasks.created_at, c.last) "
+        "FROM (SELECT task_id, count(*) AS count, max(created_at) AS last FROM comments GROUP BY task_id) AS c "
+        "WHERE c.task_id = tasks.id"
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_comments_task_id_created_at', 'comments', ['task_id', 'created_at', 'id'],
+            unique=False, postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_comments_task_id_created_at', table_name='comments', postgresql_concurrently=True)
+    op.drop_column('tasks', 'last_activity_at')
+    op.drop_column('tasks', 'comment_count')
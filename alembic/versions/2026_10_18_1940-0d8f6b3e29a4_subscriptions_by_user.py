@@ -0,0 +1,67 @@
+"""subscriptions by user
+
+Revision ID: 0d8f6b3e29a4
+Revises: 71c5d8a2e3f9
+Create Date: 2026-10-18 19:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0d8f6b3e29a4'
+down_revision: Union[str, None] = '71c5d8a2e3f9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('emailnotifications', sa.Column('user_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'emailnotifications_user_id_fkey', 'emailnotifications', 'users', ['user_id'], ['id'], ondelete='CASCADE'
+    )
+    op.execute(
+        "UPDATE emailnotifications SET user_id = users.id FROM users WHERE users.email = emailnotifications.email"
+    )
+    # addresses without an account and repeated subscriptions can't be kept
+    op.execute("DELETE FROM emailnotifications WHERE user_id IS NULL OR task_id IS NULL")
+    op.execute(
+        "DELETE FROM emailnotifications AS a USING emailnotifications AS b "
+        "WHERE a.task_id = b.task_id AND a.user_id = b.user_id AND a.id > b.id"
+    )
+    op.alter_column('emailnotifications', 'user_id', existing_type=sa.Integer(), nullable=False)
+    op.alter_column('emailnotifications', 'task_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_column('emailnotifications', 'email')
+    # recipients are looked up from the subscriptions when a message is sent
+    op.drop_column('outboxmessages', 'recipients')
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'uq_emailnotifications_task_id_user_id', 'emailnotifications', ['task_id', 'user_id'],
+            unique=True, postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_emailnotifications_user_id_task_id', 'emailnotifications', ['user_id', 'task_id'],
+            unique=False, postgresql_concurrently=True,
+        )
+    # the constraint takes over the index built above instead of building its own under a lock
+    op.execute(
+        "ALTER TABLE emailnotifications ADD CONSTRAINT uq_emailnotifications_task_id_user_id "
+        "UNIQUE USING INDEX uq_emailnotifications_task_id_user_id"
+    )
+
+
+def downgrade() -> None:
+    op.add_column('outboxmessages', sa.Column('recipients', postgresql.ARRAY(sa.String()), server_default='{}', nullable=False))
+    op.drop_constraint('uq_emailnotifications_task_id_user_id', 'emailnotifications', type_='unique')
+    op.drop_index('ix_emailnotifications_user_id_task_id', table_name='emailnotifications')
+    op.add_column('emailnotifications', sa.Column('email', sa.String(), nullable=True))
+    op.execute(
+        "UPDATE emailnotifications SET email = users.email FROM users WHERE users.id = emailnotifications.user_id"
+    )
+    op.alter_column('emailnotifications', 'email', existing_type=sa.String(), nullable=False)
+    op.alter_column('emailnotifications', 'task_id', existing_type=sa.Integer(), nullable=True)
+    op.drop_constraint('emailnotifications_user_id_fkey', 'emailnotifications', type_='foreignkey')
+    op.drop_column('emailnotifications', 'user_id')
@@ -0,0 +1,46 @@
+"""notification digests
+
+Revision ID: c6a1e4f87b05
+Revises: 0d8f6b3e29a4
+Create Date: 2026-10-18 19:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6a1e4f87b05'
+down_revision: Union[str, None] = '0d8f6b3e29a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    sa.Enum('immediate', 'digest', name='notificationmode').create(op.get_bind())
+    op.add_column('users', sa.Column(
+        'notification_mode',
+        postgresql.ENUM('immediate', 'digest', name='notificationmode', create_type=False),
+        server_default='immediate',
+        nullable=False,
+    ))
+    op.create_table('digestitems',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('task_id', sa.Integer(), nullable=False),
+    sa.Column('event', postgresql.ENUM('created', 'commented', 'closed', 'uploaded', name='notificationevent', create_type=False), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text("TIMEZONE('utc', now())"), nullable=False),
+    sa.ForeignKeyConstraint(['task_id'], ['tasks.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_digestitems_user_id_created_at', 'digestitems', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_digestitems_user_id_created_at', table_name='digestitems')
+    op.drop_table('digestitems')
+    op.drop_column('users', 'notification_mode')
+    sa.Enum(name='notificationmode').drop(op.get_bind(), checkfirst=False)
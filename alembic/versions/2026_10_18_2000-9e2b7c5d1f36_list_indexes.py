@@ -0,0 +1,46 @@
+"""list indexes
+
+Revision ID: 9e2b7c5d1f36
+Revises: c6a1e4f87b05
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e2b7c5d1f36'
+down_revision: Union[str, None] = 'c6a1e4f87b05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# built one at a time without blocking writes. A failed run keeps the ones already built,
+# which the next run skips, and leaves the failed one INVALID: drop that one before running again
+INDEXES = [
+    ('ix_tasks_created_at_id', 'tasks', [sa.text('created_at DESC'), sa.text('id DESC')], {}),
+    ('ix_tasks_owner_id_created_at_id', 'tasks', ['owner_id', sa.text('created_at DESC'), sa.text('id DESC')], {}),
+    (
+        'ix_tasks_open_created_at_id', 'tasks', [sa.text('created_at DESC'), sa.text('id DESC')],
+        {'postgresql_where': sa.text("status = 'open'")},
+    ),
+    ('ix_comments_owner_id', 'comments', ['owner_id'], {}),
+    ('ix_taskfiles_owner_id', 'taskfiles', ['owner_id'], {}),
+    ('ix_taskfiles_task_id_id', 'taskfiles', ['task_id', 'id'], {}),
+    ('ix_digestitems_task_id', 'digestitems', ['task_id'], {}),
+    ('ix_outboxmessages_task_id_id', 'outboxmessages', ['task_id', 'id'], {}),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, kw in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True, **kw)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, kw in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,68 @@
+"""task counters
+
+Revision ID: 4b8d2f6e0a73
+Revises: 9e2b7c5d1f36
+Create Date: 2026-10-18 20:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '4b8d2f6e0a73'
+down_revision: Union[str, None] = '9e2b7c5d1f36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    taskstatus = postgresql.ENUM('open', 'closed', name='taskstatus', create_type=False)
+    op.create_table('taskstatuscounts',
+    sa.Column('status', taskstatus, nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('status', 'shard')
+    )
+    op.create_table('ownertaskcounts',
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('status', taskstatus, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('owner_id', 'status')
+    )
+    op.create_index('ix_ownertaskcounts_status_count', 'ownertaskcounts', ['status', 'count'], unique=False)
+    op.create_table('dailytaskcounts',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('created', sa.Integer(), nullable=False),
+    sa.Column('closed', sa.Integer(), nullable=False),
+    sa.Column('comments', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'shard')
+    )
+    # the same counts as `python -m tasks.stats`, which can be run again after loading data
+    op.execute(
+        "INSERT INTO taskstatuscounts (status, shard, count) "
+        "SELECT status, 0, count(*) FROM tasks GROUP BY status"
+    )
+    op.execute(
+        "INSERT INTO ownertaskcounts (owner_id, status, count) "
+        "SELECT owner_id, status, count(*) FROM tasks WHERE owner_id IS NOT NULL GROUP BY owner_id, status"
+    )
+    op.execute(
+        "INSERT INTO dailytaskcounts (day, shard, created, closed, comments) "
+        "SELECT day, 0, sum(created), sum(closed), sum(comments) FROM ("
+        "SELECT CAST(created_at AS DATE) AS day, 1 AS created, 0 AS closed, 0 AS comments FROM tasks "
+        "UNION ALL SELECT CAST(last_activity_at AS DATE), 0, 1, 0 FROM tasks WHERE status = 'closed' "
+        "UNION ALL SELECT CAST(created_at AS DATE), 0, 0, 1 FROM comments"
+        ") AS events GROUP BY day"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('dailytaskcounts')
+    op.drop_index('ix_ownertaskcounts_status_count', table_name='ownertaskcounts')
+    op.drop_table('ownertaskcounts')
+    op.drop_table('taskstatuscounts')
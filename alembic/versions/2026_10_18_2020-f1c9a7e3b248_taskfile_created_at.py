@@ -0,0 +1,28 @@
+"""taskfile created at
+
+Revision ID: f1c9a7e3b248
+Revises: 4b8d2f6e0a73
+Create Date: 2026-10-18 20:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c9a7e3b248'
+down_revision: Union[str, None] = '4b8d2f6e0a73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # upload time wasn't stored before, existing files get the time of the migration;
+    # the default is stable, so the column is added without rewriting taskfiles
+    op.add_column('taskfiles', sa.Column('created_at', sa.DateTime(), server_default=sa.text("TIMEZONE('utc', now())"), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('taskfiles', 'created_at')
@@ -0,0 +1,34 @@
+"""taskfile previews
+
+Revision ID: a5e3d9b7c610
+Revises: f1c9a7e3b248
+Create Date: 2026-10-18 20:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5e3d9b7c610'
+down_revision: Union[str, None] = 'f1c9a7e3b248'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # NULL until derived; files uploaded before get their previews on first view
+    op.add_column('taskfiles', sa.Column('previews', postgresql.ARRAY(sa.String(length=20)), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_taskfiles_sha256', 'taskfiles', ['sha256'],
+            unique=False, postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_taskfiles_sha256', table_name='taskfiles', postgresql_concurrently=True)
+    op.drop_column('taskfiles', 'previews')
@@ -3,10 +3,10 @@ from typing import Optional
 
 from fastapi import Depends
 from fastapi_users.db import SQLAlchemyBaseUserTable, SQLAlchemyUserDatabase
-from sqlalchemy import String
+from sqlalchemy import String, Index, func, literal_column
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from tasks.models import Task, Comment, TaskFile
+from tasks.models import Task, Comment, TaskFile, NotificationMode
 from database import Base, get_async_session
 
 
@@ -21,6 +21,9 @@ class User(SQLAlchemyBaseUserTable[int], Base):
     is_active: Mapped[bool] = mapped_column(default=True, nullable=False)
     is_superuser: Mapped[bool] = mapped_column(default=False, nullable=False)
     is_verified: Mapped[bool] = mapped_column(default=False, nullable=False)
+    notification_mode: Mapped[NotificationMode] = mapped_column(
+        default=NotificationMode.immediate, server_default=NotificationMode.immediate.name
+    )
     comments: Mapped[Optional[list["Comment"]]] = relationship(
         back_populates="owner")
     tasks: Mapped[Optional[list["Task"]]] = relationship(
@@ -28,6 +31,11 @@ class User(SQLAlchemyBaseUserTable[int], Base):
     files: Mapped[Optional[list["TaskFile"]]] = relationship(
         back_populates="owner")
 
+    __table_args__ = (
+        # fastapi-users looks users up by lower(email) on every login
+        Index("ix_users_email_lower", func.lower(literal_column("email"))),
+    )
+
     def __repr__(self):
         return self.username
 
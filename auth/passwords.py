@@ -0,0 +1,44 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi_users.password import PasswordHelper
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+from pwdlib.hashers.bcrypt import BcryptHasher
+
+from config import (
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_TIME_COST,
+    PASSWORD_HASH_MEMORY_COST,
+    PASSWORD_HASH_PARALLELISM,
+    PASSWORD_HASH_BCRYPT_ROUNDS,
+)
+
+# argon2 and bcrypt release the GIL while hashing, so threads are enough to
+# keep the event loop free; the pool size caps how many run at once
+executor = ThreadPoolExecutor(PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+
+
+class AsyncPasswordHelper(PasswordHelper):
+    def __init__(self):
+        # the first hasher is used for new hashes, a stored hash made with other
+        # parameters (or with bcrypt) is upgraded by verify_and_update on login
+        super().__init__(PasswordHash((
+            Argon2Hasher(
+                time_cost=PASSWORD_HASH_TIME_COST,
+                memory_cost=PASSWORD_HASH_MEMORY_COST,
+                parallelism=PASSWORD_HASH_PARALLELISM,
+            ),
+            BcryptHasher(rounds=PASSWORD_HASH_BCRYPT_ROUNDS),
+        )))
+
+    async def hash_async(self, password: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.hash, password)
+
+    async def verify_and_update_async(self, plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.verify_and_update, plain_password, hashed_password)
+
+
+password_helper = AsyncPasswordHelper()
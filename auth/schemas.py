@@ -2,6 +2,8 @@ from typing import Optional
 
 from fastapi_users import schemas
 
+from tasks.models import NotificationMode
+
 
 class UserRead(schemas.BaseUser[int]):
     id: int
@@ -10,6 +12,7 @@ class UserRead(schemas.BaseUser[int]):
     is_active: bool = True
     is_superuser: bool = False
     is_verified: bool = False
+    notification_mode: NotificationMode = NotificationMode.immediate
 
     class Config:
         from_attributes = True
@@ -22,6 +25,7 @@ class UserCreate(schemas.BaseUserCreate):
     is_active: Optional[bool] = True
     is_superuser: Optional[bool] = False
     is_verified: Optional[bool] = False
+    notification_mode: NotificationMode = NotificationMode.immediate
 
 
 class UserUpdate(schemas.BaseUserUpdate):
@@ -30,6 +34,7 @@ class UserUpdate(schemas.BaseUserUpdate):
     is_active: Optional[bool] = None
     is_superuser: Optional[bool] = None
     is_verified: Optional[bool] = None
+    notification_mode: Optional[NotificationMode] = None
 
 from tasks.schemas import TaskRead, CommentRead, TaskFileRead
 
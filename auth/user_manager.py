@@ -1,33 +1,136 @@
-from typing import Optional
+import asyncio
+import time
+from types import MappingProxyType
+from typing import Optional, Any
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, FastAPIUsers, IntegerIDMixin, exceptions, models, schemas
+from fastapi.security import OAuth2PasswordRequestForm
 from fastapi_users.authentication import (
     AuthenticationBackend,
     CookieTransport,
     JWTStrategy,
 )
 import jwt
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
 
+from cache import TTLCache, cache
+from config import TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL, USER_CACHE_SIZE, USER_CACHE_TTL, CACHE_BACKEND, WEB_PROCESSES
 from fastapi_users.db import SQLAlchemyUserDatabase
 from .models import User, get_user_db
+from .passwords import password_helper
 from fastapi_users.jwt import generate_jwt, decode_jwt
 SECRET = "SECRET"
 
+# verified claims by token and users by id, so an authenticated request
+# costs neither a signature check nor a users lookup while they are warm
+token_claims = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+# a cached user is checked against its generation in the response cache backend, so a change
+# made on one worker reaches the others; without a shared backend several workers can't see
+# each other's changes and users are looked up on every request
+user_cache_enabled = bool(CACHE_BACKEND) or WEB_PROCESSES == 1
+pending_invalidations: set[asyncio.Task] = set()
+
+
+def user_snapshot(user: User) -> MappingProxyType:
+    # the cache keeps column values, never the instance of the session that loaded it
+    return MappingProxyType({attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+
+
+def user_from_snapshot(snapshot: MappingProxyType) -> User:
+    # a fresh detached instance for every request, so no two requests share one object
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return user
+
+
+def decode_claims(token, decode_key, token_audience, algorithms):
+    claims = token_claims.get(token)
+    if claims is None:
+        try:
+            claims = decode_jwt(token, decode_key, token_audience, algorithms)
+        except jwt.PyJWTError:
+            return None
+        ttl = TOKEN_CACHE_TTL
+        if "exp" in claims:
+            # never serve a token from cache past its own expiry
+            ttl = min(ttl, claims["exp"] - time.time())
+        token_claims.set(token, claims, ttl)
+    return claims
+
+
+def invalidate_user(user_id):
+    user_cache.pop(user_id)
+    token_claims.discard_if(lambda claims: claims.get("sub") == str(user_id))
+
+
+def user_scope(user_id) -> str:
+    return f"user:{user_id}"
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def on_user_changed(mapper, connection, target):
+    # also covers edits made through the admin panel, which bypass UserManager
+    invalidate_user(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_users", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def on_commit(session):
+    # the generation moves once the change is committed, so no worker reloads the old row under it
+    user_ids = session.info.pop("changed_users", ())
+    if not user_ids:
+        return
+    loop = asyncio.get_running_loop()
+    for user_id in user_ids:
+        task = loop.create_task(cache.invalidate(user_scope(user_id)))
+        pending_invalidations.add(task)
+        task.add_done_callback(pending_invalidations.discard)
+
+
+@event.listens_for(Session, "after_rollback")
+def on_rollback(session):
+    session.info.pop("changed_users", None)
+
 
 def is_admin_token(request, token, decode_key, token_audience, algorithms):
-    try:
-        data = decode_jwt(
-            token, decode_key, token_audience, algorithms
-        )
-        is_admin = data.get("admin")
-        # request.cookies["admin"] = is_admin
-        # request.set_cookie(key='admin', value=is_admin)
-    except jwt.PyJWTError:
+    data = decode_claims(token, decode_key, token_audience, algorithms)
+    if data is None:
         return None
+    is_admin = data.get("admin")
+    # request.cookies["admin"] = is_admin
+    # request.set_cookie(key='admin', value=is_admin)
     return is_admin
 
 
 class MyJWTStrategy(JWTStrategy):
+    async def read_token(self, token: Optional[str], user_manager: BaseUserManager[User, int]) -> Optional[User]:
+        if token is None:
+            return None
+        claims = decode_claims(token, self.decode_key, self.token_audience, [self.algorithm])
+        if claims is None or claims.get("sub") is None:
+            return None
+        try:
+            user_id = user_manager.parse_id(claims["sub"])
+        except exceptions.InvalidID:
+            return None
+        if user_cache_enabled:
+            generation = await cache.generation(user_scope(user_id))
+            entry = user_cache.get(user_id)
+            if entry is not None and entry[0] == generation:
+                return user_from_snapshot(entry[1])
+        try:
+            user = await user_manager.get(user_id)
+        except exceptions.UserNotExists:
+            return None
+        if user_cache_enabled:
+            user_cache.set(user_id, (generation, user_snapshot(user)))
+        return user
+
     async def write_token(self, user: models.UP) -> str:
         data = {"sub": str(user.id), "aud": self.token_audience, "admin": user.is_superuser}
         return generate_jwt(
@@ -42,6 +145,9 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
     async def on_after_register(self, user: User, request: Optional[Request] = None):
         print(f"User {user.id} has registered.")
 
+    async def on_after_update(self, user: User, update_dict: dict, request: Optional[Request] = None):
+        invalidate_user(user.id)
+
     async def create(
         self,
         user_create: schemas.UC,
@@ -60,7 +166,7 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
             else user_create.create_update_dict_superuser()
         )
         password = user_dict.pop("password")
-        user_dict["hashed_password"] = self.password_helper.hash(password)
+        user_dict["hashed_password"] = await self.password_helper.hash_async(password)
 
         created_user = await self.user_db.create(user_dict)
 
@@ -68,9 +174,40 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
 
         return created_user
 
+    async def authenticate(self, credentials: OAuth2PasswordRequestForm) -> Optional[models.UP]:
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # hash anyway so unknown emails take as long as wrong passwords
+            await self.password_helper.hash_async(credentials.password)
+            return None
+
+        verified, updated_password_hash = await self.password_helper.verify_and_update_async(
+            credentials.password, user.hashed_password
+        )
+        if not verified:
+            return None
+        if updated_password_hash is not None:
+            # the cost settings changed since this hash was made
+            await self.user_db.update(user, {"hashed_password": updated_password_hash})
+
+        return user
+
+    async def _update(self, user: models.UP, update_dict: dict[str, Any]) -> models.UP:
+        # current_active_user may come from the cache; write to the row as this session sees it
+        user = await self.get(user.id)
+        password = update_dict.get("password")
+        if password is not None:
+            await self.validate_password(password, user)
+            update_dict = {
+                **{k: v for k, v in update_dict.items() if k != "password"},
+                "hashed_password": await self.password_helper.hash_async(password),
+            }
+        return await super()._update(user, update_dict)
+
 
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
-    yield UserManager(user_db)
+    yield UserManager(user_db, password_helper)
 
 
 cookie_transport = CookieTransport(cookie_name="bonds", cookie_max_age=3600)
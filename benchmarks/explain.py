@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+
+import httpx
+from sqlalchemy import event
+
+from benchmarks.load import login, scenarios
+
+EXPLAINED = ("SELECT", "WITH", "UPDATE", "DELETE")
+# a few rows per status and shard, scanning them is cheaper than any index
+SMALL_TABLES = ["taskstatuscounts"]
+# tables the seeder leaves (nearly) empty, such as taskfiles, are scanned as well
+SMALL_TABLE_ROWS = 1000
+
+
+def seq_scans(plan: dict):
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan.get("Relation Name")
+    for child in plan.get("Plans", ()):
+        yield from seq_scans(child)
+
+
+async def capture_statements(args) -> dict[str, tuple]:
+    import main
+    from database import engines
+
+    statements = {}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(EXPLAINED):
+            statements.setdefault(statement, parameters)
+
+    for engine in engines.values():
+        event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        # https, the auth cookie is Secure and would not be sent back over http
+        async with httpx.AsyncClient(transport=transport, base_url="https://bench") as client:
+            # user 1 is the seeded superuser
+            response = await login(client, 1)
+            if response.status_code >= 400:
+                raise SystemExit(f"login failed with {response.status_code}, was the database seeded?")
+            for name, make_request in scenarios(args, random.Random(args.seed)).items():
+                method, url, body = make_request()
+                response = await client.request(method, url, json=body)
+                print(f"{response.status_code} {name}")
+    finally:
+        for engine in engines.values():
+            event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+async def run(args) -> int:
+    statements = await capture_statements(args)
+    from database import engine
+
+    failures = 0
+    async with engine.connect() as conn:
+        small = await conn.exec_driver_sql(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND reltuples < %s" % args.min_rows
+        )
+        allowed = set(args.allow) | set(small.scalars())
+        for statement, parameters in statements.items():
+            result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+            plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            tables = sorted({t for t in seq_scans(plan[0]["Plan"]) if t not in allowed})
+            summary = " ".join(statement.split())[:120]
+            if tables:
+                failures += 1
+                print(f"SEQ SCAN on {', '.join(tables)}: {summary}")
+            elif args.verbose:
+                print(f"ok: {summary}")
+        await conn.rollback()
+    print(f"{len(statements)} statements, {failures} with sequential scans")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="EXPLAIN every query the task endpoints run and fail on sequential scans"
+    )
+    parser.add_argument("--users", type=int, default=100_000, help="users created by the seeder")
+    parser.add_argument("--tasks", type=int, default=1_000_000, help="tasks created by the seeder")
+    parser.add_argument("--writes", action="store_true", help="also call the write endpoints")
+    parser.add_argument(
+        "--allow", nargs="*", default=SMALL_TABLES, help=f"tables allowed to be scanned (default: {' '.join(SMALL_TABLES)})"
+    )
+    parser.add_argument(
+        "--min-rows", type=int, default=SMALL_TABLE_ROWS, help="tables with fewer rows may be scanned"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="also print statements without scans")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import contextvars
+import random
+import statistics
+import time
+from dataclasses import dataclass, field
+
+import httpx
+
+from benchmarks.seed import PASSWORD, WORDS, user_email
+
+
+@dataclass
+class Result:
+    latencies: list[float] = field(default_factory=list)
+    queries: list[int] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+    lag: list[float] = field(default_factory=list)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+
+current_counter: contextvars.ContextVar[QueryCounter | None] = contextvars.ContextVar("current_counter", default=None)
+
+
+def count_queries(engines):
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter = current_counter.get()
+        if counter is not None:
+            counter.count += 1
+
+    for engine in engines:
+        event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+def scenarios(args, rng: random.Random):
+    def task_id():
+        return rng.randint(1, args.tasks)
+
+    reads = {
+        "GET /tasks/": lambda: ("GET", "/tasks/", None),
+        "GET /tasks/?summary": lambda: ("GET", "/tasks/?summary=true", None),
+        "GET /tasks/?task_status": lambda: ("GET", "/tasks/?task_status=open&summary=true", None),
+        "GET /tasks/?task_filter": lambda: ("GET", f"/tasks/?task_filter={rng.choice(WORDS)}&summary=true", None),
+        "GET /tasks/my_tasks": lambda: ("GET", "/tasks/my_tasks?summary=true", None),
+        "GET /tasks/watching": lambda: ("GET", "/tasks/watching?summary=true", None),
+        "GET /tasks/stats": lambda: ("GET", "/tasks/stats", None),
+        "GET /tasks/{id}": lambda: ("GET", f"/tasks/{task_id()}", None),
+        "GET /tasks/{id}/comments": lambda: ("GET", f"/tasks/{task_id()}/comments", None),
+    }
+    writes = {
+        "POST /tasks/": lambda: ("POST", "/tasks/", {"headline": "bench", "description": "load test"}),
+        "POST /tasks/{id}/comment": lambda: (
+            "POST", "/tasks/{id}/comment".format(id=(i := task_id())), {"text": "load test", "task_id": i},
+        ),
+    }
+    return {**reads, **(writes if args.writes else {})}
+
+
+async def login(client: httpx.AsyncClient, user_id: int) -> httpx.Response:
+    return await client.post("/auth/login", data={"username": user_email(user_id), "password": PASSWORD})
+
+
+async def measure_lag(result: Result, stop: asyncio.Event, interval: float = 0.01):
+    # how late the event loop wakes up, i.e. how long something blocked it
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        result.lag.append(time.perf_counter() - start - interval)
+
+
+async def run_scenario(client_factory, args, make_request, rng: random.Random) -> Result:
+    result = Result()
+    remaining = args.requests
+
+    async def worker():
+        nonlocal remaining
+        async with client_factory() as client:
+            if make_request is not None:
+                response = await login(client, rng.randint(1, args.users))
+                if response.status_code >= 400:
+                    raise SystemExit(f"login failed with {response.status_code}, was the database seeded?")
+            while remaining > 0:
+                remaining -= 1
+                counter = QueryCounter()
+                current_counter.set(counter)
+                start = time.perf_counter()
+                if make_request is None:
+                    response = await login(client, rng.randint(1, args.users))
+                else:
+                    method, url, body = make_request()
+                    response = await client.request(method, url, json=body)
+                result.latencies.append(time.perf_counter() - start)
+                result.queries.append(counter.count)
+                if response.status_code >= 400:
+                    result.errors += 1
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(measure_lag(result, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    result.elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    return result
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def report(name: str, result: Result, in_process: bool):
+    latencies = result.latencies
+    if in_process:
+        queries = f"{statistics.mean(result.queries):8.1f} {max(result.queries):5} {max(result.lag, default=0) * 1000:8.1f}"
+    else:
+        queries = f"{'-':>8} {'-':>5} {'-':>8}"
+    print(
+        f"{name:28} {len(latencies):7} {result.errors:6} {len(latencies) / result.elapsed:8.1f} "
+        f"{percentile(latencies, 0.5) * 1000:8.1f} {percentile(latencies, 0.95) * 1000:8.1f} "
+        f"{percentile(latencies, 0.99) * 1000:8.1f} {queries}"
+    )
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    in_process = args.url is None
+    if in_process:
+        import main
+        from database import engines
+
+        count_queries(engines.values())
+        transport = httpx.ASGITransport(app=main.app)
+
+        def client_factory():
+            # https, the auth cookie is Secure and would not be sent back over http
+            return httpx.AsyncClient(transport=transport, base_url="https://bench")
+    else:
+        def client_factory():
+            return httpx.AsyncClient(base_url=args.url, timeout=60)
+
+    selected = scenarios(args, rng)
+    if args.only:
+        selected = {name: make for name, make in selected.items() if any(o in name for o in args.only)}
+    print(f"{'endpoint':28} {'reqs':>7} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'queries':>8} {'max':>5} {'lag ms':>8}")
+    if not args.only or any("login" in o for o in args.only):
+        report("POST /auth/login", await run_scenario(client_factory, args, None, rng), in_process)
+    for name, make_request in selected.items():
+        report(name, await run_scenario(client_factory, args, make_request, rng), in_process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the tasks API and report latency per endpoint")
+    parser.add_argument("--url", help="benchmark a running server instead of the app in-process")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=100_000, help="users created by the seeder")
+    parser.add_argument("--tasks", type=int, default=1_000_000, help="tasks created by the seeder")
+    parser.add_argument("--writes", action="store_true", help="also benchmark the write endpoints")
+    parser.add_argument("--only", nargs="*", help="substrings of endpoint names to run")
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
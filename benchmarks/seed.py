@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import asyncpg
+
+from auth.passwords import password_helper
+from config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
+
+PASSWORD = "password"
+WORDS = (
+    "login error page report server timeout export import email file upload "
+    "client invoice payment user account access admin database backup slow "
+    "crash update release build deploy search filter status closed open task "
+    "comment attachment printer network vpn license calendar meeting"
+).split()
+BATCH = 10_000
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choices(WORDS, k=words))
+
+
+def user_email(user_id: int) -> str:
+    return f"user{user_id}@bench.local"
+
+
+async def copy_batched(conn: asyncpg.Connection, table: str, columns: list[str], records):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == BATCH:
+            await conn.copy_records_to_table(table, records=batch, columns=columns)
+            batch.clear()
+    if batch:
+        await conn.copy_records_to_table(table, records=batch, columns=columns)
+
+
+async def create_schema():
+    import main  # noqa: F401 (imports every model)
+    from database import Base, engine
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
+
+async def rebuild_stats():
+    from tasks.stats import rebuild
+    from database import async_session_maker, engine
+
+    async with async_session_maker() as session:
+        await rebuild(session)
+        await session.commit()
+    await engine.dispose()
+
+
+async def seed(users: int, tasks: int, comments: int, seed_value: int, reset: bool):
+    rng = random.Random(seed_value)
+    conn = await asyncpg.connect(
+        user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, database=DB_NAME
+    )
+    try:
+        if reset:
+            await conn.execute(
+                "TRUNCATE users, tasks, comments, emailnotifications, taskstatuscounts, ownertaskcounts, "
+                "dailytaskcounts RESTART IDENTITY CASCADE"
+            )
+
+        # same parameters as the app, so logins don't rehash
+        hashed_password = password_helper.hash(PASSWORD)
+        now = datetime.utcnow()
+        start = now - timedelta(days=365)
+
+        print(f"users: {users}")
+        await copy_batched(
+            conn, "users",
+            ["id", "email", "username", "registered_at", "hashed_password", "is_active", "is_superuser", "is_verified"],
+            ((i, user_email(i), f"user{i}", start, hashed_password, True, i == 1, True) for i in range(1, users + 1)),
+        )
+
+        # spread comments over tasks up front so comment_count matches what gets copied
+        counts = [0] * tasks
+        for _ in range(comments):
+            counts[int(rng.paretovariate(1.2)) % tasks] += 1
+        rng.shuffle(counts)
+        owners = [rng.randint(1, users) for _ in range(tasks)]
+        created = sorted(start + timedelta(seconds=rng.uniform(0, 365 * 86400)) for _ in range(tasks))
+
+        print(f"tasks: {tasks}")
+        await copy_batched(
+            conn, "tasks",
+            ["id", "headline", "description", "status", "created_at", "owner_id", "comment_count", "last_activity_at"],
+            (
+                (i + 1, sentence(rng, 4), sentence(rng, 30), "closed" if rng.random() < 0.6 else "open",
+                 created[i], owners[i], counts[i], created[i])
+                for i in range(tasks)
+            ),
+        )
+
+        print(f"comments: {comments}")
+        await copy_batched(
+            conn, "comments",
+            ["text", "task_id", "owner_id", "created_at"],
+            (
+                (sentence(rng, 12), task_id + 1, rng.randint(1, users), created[task_id] + timedelta(minutes=n))
+                for task_id in range(tasks)
+                for n in range(counts[task_id])
+            ),
+        )
+
+        print("subscriptions")
+        await copy_batched(
+            conn, "emailnotifications",
+            ["task_id", "user_id"],
+            ((i + 1, owners[i]) for i in range(tasks)),
+        )
+
+        print("stats")
+        await rebuild_stats()
+
+        for table in ("users", "tasks", "comments", "emailnotifications"):
+            await conn.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT coalesce(max(id), 1) FROM {table}))"
+            )
+        await conn.execute("ANALYZE")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a throwaway database with benchmark data")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--comments", type=int, default=10_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--create-schema", action="store_true", help="create the tables from the models first")
+    parser.add_argument("--reset", action="store_true", help="truncate the seeded tables first")
+    args = parser.parse_args()
+    if args.create_schema:
+        asyncio.run(create_schema())
+    asyncio.run(seed(args.users, args.tasks, args.comments, args.seed, args.reset))
+
+
+if __name__ == "__main__":
+    main()
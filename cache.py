@@ -0,0 +1,186 @@
+from abc import ABC, abstractmethod
+import importlib
+import logging
+import time
+from collections import OrderedDict, defaultdict
+
+from config import CACHE_TTL, CACHE_MAX_BYTES, CACHE_MAX_COUNTERS, CACHE_BACKEND, CACHE_REPLICA_LAG, WEB_PROCESSES
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    # small synchronous cache for python objects, bounded by entry count
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        self.entries.pop(key, None)
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def discard_if(self, predicate):
+        for key in [key for key, (_, value) in self.entries.items() if predicate(value)]:
+            del self.entries[key]
+
+
+class CacheBackend(ABC):
+    # a shared backend (redis, memcached) implements these and is set with CACHE_BACKEND=module:Class
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def incr(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    async def counter(self, key: str) -> int:
+        ...
+
+
+class NullBackend(CacheBackend):
+    # caches nothing, so there is nothing for a generation to invalidate
+    async def get(self, key: str) -> bytes | None:
+        return None
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        pass
+
+    async def delete(self, key: str):
+        pass
+
+    async def incr(self, key: str) -> int:
+        return 0
+
+    async def counter(self, key: str) -> int:
+        return 0
+
+
+class MemoryBackend(CacheBackend):
+    # only correct within one process: another worker never sees its generations change
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, max_counters: int = CACHE_MAX_COUNTERS):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self.max_counters = max_counters
+        self.counters: OrderedDict[str, int] = OrderedDict()
+        # counters dropped for space come back above any value they had, so a key
+        # built with an old generation is never handed out again
+        self.floor = 0
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        self._remove(key)
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    async def delete(self, key: str):
+        self._remove(key)
+
+    async def incr(self, key: str) -> int:
+        value = self.counters.pop(key, self.floor) + 1
+        self.counters[key] = value
+        while len(self.counters) > self.max_counters:
+            _, dropped = self.counters.popitem(last=False)
+            self.floor = max(self.floor, dropped + 1)
+        return value
+
+    async def counter(self, key: str) -> int:
+        value = self.counters.get(key)
+        if value is None:
+            return self.floor
+        self.counters.move_to_end(key)
+        return value
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, ttl: float = CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits: dict[str, int] = defaultdict(int)
+        self.misses: dict[str, int] = defaultdict(int)
+
+    async def get(self, namespace: str, key: str) -> bytes | None:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses[namespace] += 1
+        else:
+            self.hits[namespace] += 1
+        return value
+
+    async def set(self, key: str, value: bytes):
+        await self.backend.set(key, value, self.ttl)
+
+    async def generation(self, scope: str) -> str:
+        # keys embed the generation of their scope, bumping it drops them all at once
+        return str(await self.backend.counter(f"gen:{scope}"))
+
+    async def invalidate(self, scope: str):
+        await self.backend.incr(f"gen:{scope}")
+        if CACHE_REPLICA_LAG > 0:
+            await self.backend.set(f"written:{scope}", b"1", CACHE_REPLICA_LAG)
+
+    async def recently_written(self, scope: str) -> bool:
+        # a replica may still lag behind a write this recent
+        return await self.backend.get(f"written:{scope}") is not None
+
+
+def load_backend() -> CacheBackend:
+    if CACHE_BACKEND:
+        module, _, name = CACHE_BACKEND.partition(":")
+        return getattr(importlib.import_module(module), name)()
+    if WEB_PROCESSES > 1 and CACHE_TTL > 0:
+        # each worker would keep its own generations and serve data another worker has invalidated
+        logger.warning("Response cache disabled: the in-memory backend can't be shared by %s workers, "
+                       "set CACHE_BACKEND to a shared backend or WEB_WORKERS=1", WEB_PROCESSES)
+        return NullBackend()
+    return MemoryBackend()
+
+
+cache = ResponseCache(load_backend())
@@ -13,3 +13,82 @@ EMAIL = os.environ.get("EMAIL")
 EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD")
 DEBAG = os.environ.get("DEBAG") or False
 
+SMTP_HOST = os.environ.get("SMTP_HOST") or "smtp.gmail.com"
+SMTP_PORT = int(os.environ.get("SMTP_PORT") or 465)
+SMTP_SSL = os.environ.get("SMTP_SSL", "true").lower() not in ("0", "false", "no")
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE") or 2)
+# newest files are attached up to this many bytes in total, the rest are linked
+EMAIL_ATTACHMENTS_MAX_SIZE = int(os.environ.get("EMAIL_ATTACHMENTS_MAX_SIZE") or 10 * 1024 * 1024)
+# address of the API in links sent by email
+PUBLIC_URL = (os.environ.get("PUBLIC_URL") or "http://localhost:8000").rstrip("/")
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE") or 50)
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL") or 1)
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS") or 8)
+OUTBOX_RETRY_DELAY = float(os.environ.get("OUTBOX_RETRY_DELAY") or 5)
+OUTBOX_LEASE = float(os.environ.get("OUTBOX_LEASE") or 300)
+TASKFILES_DIR = os.environ.get("TASKFILES_DIR") or "static/taskfiles"
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE") or 20 * 1024 * 1024)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND") or "local"
+S3_BUCKET = os.environ.get("S3_BUCKET") or "taskfiles"
+S3_PREFIX = os.environ.get("S3_PREFIX") or ""
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+S3_REGION = os.environ.get("S3_REGION")
+S3_ACCESS_KEY = os.environ.get("S3_ACCESS_KEY")
+S3_SECRET_KEY = os.environ.get("S3_SECRET_KEY")
+S3_URL_TTL = int(os.environ.get("S3_URL_TTL") or 300)
+PREVIEW_WORKERS = int(os.environ.get("PREVIEW_WORKERS") or min(2, os.cpu_count() or 1))
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE") or 256)
+PREVIEW_SIZE = int(os.environ.get("PREVIEW_SIZE") or 1024)
+PREVIEW_TEXT_LIMIT = int(os.environ.get("PREVIEW_TEXT_LIMIT") or 64 * 1024)
+PREVIEW_MAX_AGE = int(os.environ.get("PREVIEW_MAX_AGE") or 365 * 24 * 3600)
+PREVIEW_QUEUE_SIZE = int(os.environ.get("PREVIEW_QUEUE_SIZE") or 100)
+PREVIEW_MAX_PIXELS = int(os.environ.get("PREVIEW_MAX_PIXELS") or 50_000_000)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE") or 5)
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW") or 10)
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT") or 30)
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE") or 1800)
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() not in ("0", "false", "no")
+DB_STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT") or 30000)
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE") or 100)
+DB_REPLICA_HOST = os.environ.get("DB_REPLICA_HOST")
+DB_REPLICA_PORT = os.environ.get("DB_REPLICA_PORT") or DB_PORT
+CACHE_TTL = float(os.environ.get("CACHE_TTL") or 60)
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES") or 64 * 1024 * 1024)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND")
+CACHE_MAX_COUNTERS = int(os.environ.get("CACHE_MAX_COUNTERS") or 100000)
+CACHE_REPLICA_LAG = float(os.environ.get("CACHE_REPLICA_LAG") or 5)
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS") or 500)
+DISPATCHER_METRICS_PORT = int(os.environ.get("DISPATCHER_METRICS_PORT") or 0)
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE") or 10000)
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL") or 300)
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE") or 10000)
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL") or 30)
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE") or 100)
+EVENTS_HEARTBEAT = float(os.environ.get("EVENTS_HEARTBEAT") or 15)
+EVENTS_REPLAY_LIMIT = int(os.environ.get("EVENTS_REPLAY_LIMIT") or 500)
+EVENTS_RECONNECT_DELAY = float(os.environ.get("EVENTS_RECONNECT_DELAY") or 2)
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS") or min(4, os.cpu_count() or 1))
+PASSWORD_HASH_TIME_COST = int(os.environ.get("PASSWORD_HASH_TIME_COST") or 3)
+PASSWORD_HASH_MEMORY_COST = int(os.environ.get("PASSWORD_HASH_MEMORY_COST") or 65536)
+PASSWORD_HASH_PARALLELISM = int(os.environ.get("PASSWORD_HASH_PARALLELISM") or 4)
+PASSWORD_HASH_BCRYPT_ROUNDS = int(os.environ.get("PASSWORD_HASH_BCRYPT_ROUNDS") or 12)
+WEB_HOST = os.environ.get("WEB_HOST") or "0.0.0.0"
+WEB_PORT = int(os.environ.get("WEB_PORT") or 8000)
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS") or os.cpu_count() or 1)
+# processes actually serving the app: serve.py exports WEB_WORKERS here for the workers it starts,
+# anything else (plain `uvicorn main:app`, tests, benchmarks) is one process unless told otherwise
+WEB_PROCESSES = int(os.environ.get("WEB_PROCESSES") or 1)
+WEB_GRACEFUL_TIMEOUT = int(os.environ.get("WEB_GRACEFUL_TIMEOUT") or 20)
+DB_POOL_WARMUP = os.environ.get("DB_POOL_WARMUP", "true").lower() not in ("0", "false", "no")
+DISPATCHER_DRAIN_TIMEOUT = float(os.environ.get("DISPATCHER_DRAIN_TIMEOUT") or 20)
+DIGEST_WINDOW = float(os.environ.get("DIGEST_WINDOW") or 900)
+DIGEST_MAX_EVENTS = int(os.environ.get("DIGEST_MAX_EVENTS") or 20)
+DIGEST_BATCH_SIZE = int(os.environ.get("DIGEST_BATCH_SIZE") or 50)
+STATS_SHARDS = int(os.environ.get("STATS_SHARDS") or 8)
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND")
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS") or 100000)
+RATE_LIMIT_WRITE_RATE = float(os.environ.get("RATE_LIMIT_WRITE_RATE") or 1)
+RATE_LIMIT_WRITE_BURST = int(os.environ.get("RATE_LIMIT_WRITE_BURST") or 20)
+RATE_LIMIT_DOWNLOAD_RATE = float(os.environ.get("RATE_LIMIT_DOWNLOAD_RATE") or 5)
+RATE_LIMIT_DOWNLOAD_BURST = int(os.environ.get("RATE_LIMIT_DOWNLOAD_BURST") or 50)
+OUTBOX_COALESCE = os.environ.get("OUTBOX_COALESCE", "true").lower() not in ("0", "false", "no")
@@ -1,21 +1,130 @@
+import asyncio
+import logging
+import time
 from typing import AsyncGenerator
 
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, event, exc, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
+from config import (
+    DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    DB_STATEMENT_TIMEOUT, DB_STATEMENT_CACHE_SIZE, DB_REPLICA_HOST, DB_REPLICA_PORT,
+)
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+REPLICA_DATABASE_URL = (
+    f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+    if DB_REPLICA_HOST else None
+)
 metadata = MetaData()
 Base = declarative_base()
 
 
-engine = create_async_engine(DATABASE_URL)
+class PoolStats:
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.wait_max = 0.0
+
+
+pool_stats: dict[str, PoolStats] = {}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # times every checkout, including the wait for a free connection when the pool is exhausted
+    def _do_get(self):
+        stats = pool_stats[self.logging_name]
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            stats.wait_seconds += waited
+            stats.wait_max = max(stats.wait_max, waited)
+
+
+def make_engine(url: str, name: str):
+    pool_stats[name] = stats = PoolStats()
+    new_engine = create_async_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_logging_name=name,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT)},
+        },
+    )
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        stats.connects += 1
+
+    @event.listens_for(new_engine.sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.checkouts += 1
+
+    @event.listens_for(new_engine.sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        stats.checkins += 1
+
+    return new_engine
+
+
+engine = make_engine(DATABASE_URL, "primary")
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# without a replica configured reads simply go to the primary
+replica_engine = make_engine(REPLICA_DATABASE_URL, "replica") if REPLICA_DATABASE_URL else engine
+replica_session_maker = sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False)
+
+engines = {"primary": engine}
+if replica_engine is not engine:
+    engines["replica"] = replica_engine
+
+
+async def warm_up():
+    # open the whole pool at startup instead of on the first requests after a deploy
+    for name, pool_engine in engines.items():
+        connections = [pool_engine.connect() for _ in range(DB_POOL_SIZE)]
+        try:
+            await asyncio.gather(*(connection.start() for connection in connections))
+            for connection in connections:
+                await connection.execute(text("SELECT 1"))
+        except (OSError, exc.SQLAlchemyError) as e:
+            logger.warning("Could not warm up the %s pool: %r", name, e)
+        finally:
+            for connection in connections:
+                if connection.sync_connection is not None:
+                    await connection.close()
+
+
+async def dispose():
+    for pool_engine in engines.values():
+        await pool_engine.dispose()
+
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    async with replica_session_maker() as session:
+        yield session
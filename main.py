@@ -1,20 +1,46 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from tasks.router import router as task_router
-from fastapi.staticfiles import StaticFiles
+from tasks.bulk import router as bulk_router
+from tasks.events import router as events_router, broker
+from tasks import previews
+from metrics import router as metrics_router, MetricsMiddleware
 from auth.user_manager import auth_backend, fastapi_users
-from auth.schemas import UserCreate, UserRead
+from auth.schemas import UserCreate, UserRead, UserUpdate
 from starlette.middleware.sessions import SessionMiddleware
-from database import engine
+from config import DB_POOL_WARMUP
+from database import engine, warm_up, dispose
+from auth.passwords import executor as password_executor
 from sqladmin import Admin
 from admin import authentication_backend, UserAdmin, TaskAdmin, CommentAdmin, TaskFileAdmin
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_POOL_WARMUP:
+        await warm_up()
+    broker.start()
+    yield
+    await broker.stop()
+    await previews.stop()
+    # waits for hashes in flight from a thread, the loop keeps serving the rest of the shutdown
+    await asyncio.to_thread(password_executor.shutdown)
+    await dispose()
+
+
 app = FastAPI(
-    title="JIRAlike"
+    title="JIRAlike",
+    lifespan=lifespan,
 )
 app.add_middleware(SessionMiddleware, secret_key="some-random-string")
+app.add_middleware(MetricsMiddleware)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.include_router(bulk_router)
+app.include_router(events_router)
 app.include_router(task_router)
+app.include_router(metrics_router)
 app.include_router(
     fastapi_users.get_auth_router(auth_backend),
     prefix="/auth",
@@ -25,6 +51,11 @@ app.include_router(
     prefix="/users",
     tags=["users"]
 )
+app.include_router(
+    fastapi_users.get_users_router(UserRead, UserUpdate),
+    prefix="/users",
+    tags=["users"]
+)
 
 admin = Admin(app, engine, authentication_backend=authentication_backend)
 
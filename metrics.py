@@ -0,0 +1,295 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from cache import cache
+from config import SLOW_QUERY_MS
+from database import engines, pool_stats
+
+logger = logging.getLogger("slow_query")
+
+
+class Metric:
+    def __init__(self, name: str, kind: str, documentation: str):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.values: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, value: float = 1, **labels):
+        self.values[tuple(sorted(labels.items()))] += value
+
+    def set(self, value: float, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.values.items():
+            if labels:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"{self.name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...]):
+        super().__init__(name, "histogram", documentation)
+        self.buckets = buckets
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = defaultdict(float)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        self.sums[key] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, counts in self.counts.items():
+            label_text = "".join(f'{key}="{val}",' for key, val in labels)
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                lines.append(f'{self.name}_bucket{{{label_text}le="{bound}"}} {count}')
+            label_text = label_text.rstrip(",")
+            lines.append(f"{self.name}_sum{{{label_text}}} {self.sums[labels]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.collectors = []
+
+    def metric(self, name: str, kind: str, documentation: str) -> Metric:
+        if name not in self.metrics:
+            self.metrics[name] = Metric(name, kind, documentation)
+        return self.metrics[name]
+
+    def counter(self, name: str, documentation: str) -> Metric:
+        return self.metric(name, "counter", documentation)
+
+    def gauge(self, name: str, documentation: str) -> Metric:
+        return self.metric(name, "gauge", documentation)
+
+    def histogram(self, name: str, documentation: str, buckets: tuple[float, ...]) -> Histogram:
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, documentation, buckets)
+        return self.metrics[name]
+
+    def collector(self, func):
+        # called on every scrape to refresh gauges that are cheaper to read than to track
+        self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+pool_connects = registry.counter("db_pool_connects_total", "New DBAPI connections opened")
+pool_checkouts = registry.counter("db_pool_checkouts_total", "Connections checked out of the pool")
+pool_checkins = registry.counter("db_pool_checkins_total", "Connections returned to the pool")
+pool_timeouts = registry.counter("db_pool_timeouts_total", "Checkouts that gave up waiting for a connection")
+pool_wait = registry.counter("db_pool_wait_seconds_total", "Time spent waiting for a connection")
+pool_wait_max = registry.gauge("db_pool_wait_seconds_max", "Longest single wait for a connection")
+pool_size = registry.gauge("db_pool_size", "Configured pool size")
+pool_checked_out = registry.gauge("db_pool_checked_out", "Connections currently checked out")
+pool_overflow = registry.gauge("db_pool_overflow", "Connections currently open beyond the pool size")
+
+
+@registry.collector
+def collect_pool():
+    for name, engine in engines.items():
+        stats = pool_stats[name]
+        pool = engine.sync_engine.pool
+        pool_connects.set(stats.connects, pool=name)
+        pool_checkouts.set(stats.checkouts, pool=name)
+        pool_checkins.set(stats.checkins, pool=name)
+        pool_timeouts.set(stats.timeouts, pool=name)
+        pool_wait.set(stats.wait_seconds, pool=name)
+        pool_wait_max.set(stats.wait_max, pool=name)
+        pool_size.set(pool.size(), pool=name)
+        pool_checked_out.set(pool.checkedout(), pool=name)
+        pool_overflow.set(max(pool.overflow(), 0), pool=name)
+
+
+cache_hits = registry.counter("cache_hits_total", "Response cache hits")
+cache_misses = registry.counter("cache_misses_total", "Response cache misses")
+
+
+@registry.collector
+def collect_cache():
+    for namespace, hits in cache.hits.items():
+        cache_hits.set(hits, namespace=namespace)
+    for namespace, misses in cache.misses.items():
+        cache_misses.set(misses, namespace=namespace)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+http_requests = registry.counter("http_requests_total", "Requests handled")
+http_duration = registry.histogram("http_request_duration_seconds", "Request latency", LATENCY_BUCKETS)
+db_statements = registry.counter("db_statements_total", "SQL statements executed")
+db_time = registry.counter("db_time_seconds_total", "Time spent executing SQL")
+db_rows = registry.counter("db_rows_total", "Rows returned or affected by SQL")
+db_statements_per_request = registry.histogram(
+    "db_statements_per_request", "SQL statements per request or background job", STATEMENT_BUCKETS
+)
+slow_queries = registry.counter("db_slow_queries_total", f"Statements slower than {SLOW_QUERY_MS:g} ms")
+background_duration = registry.histogram(
+    "background_task_duration_seconds", "Background job duration", LATENCY_BUCKETS
+)
+background_failures = registry.counter("background_task_failures_total", "Background jobs that raised")
+
+
+class WorkStats:
+    def __init__(self, label: str):
+        self.label = label
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+
+current_work: contextvars.ContextVar[WorkStats | None] = contextvars.ContextVar("current_work", default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    work = current_work.get()
+    label = work.label if work else "other"
+    if work is not None:
+        work.statements += 1
+        work.db_time += elapsed
+        work.rows += max(cursor.rowcount, 0)
+    else:
+        db_statements.inc(route=label)
+        db_time.inc(elapsed, route=label)
+        db_rows.inc(max(cursor.rowcount, 0), route=label)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc(route=label)
+        logger.warning("%.1f ms in %s: %s", elapsed * 1000, label, statement)
+
+
+def handle_error(exception_context):
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument(engine):
+    sync_engine = engine.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(sync_engine, "handle_error", handle_error)
+
+
+for instrumented_engine in engines.values():
+    instrument(instrumented_engine)
+
+
+def record_work(work: WorkStats):
+    db_statements.inc(work.statements, route=work.label)
+    db_time.inc(work.db_time, route=work.label)
+    db_rows.inc(work.rows, route=work.label)
+    db_statements_per_request.observe(work.statements, route=work.label)
+
+
+@asynccontextmanager
+async def track_background(name: str):
+    work = WorkStats(name)
+    token = current_work.set(work)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        background_failures.inc(task=name)
+        raise
+    finally:
+        background_duration.observe(time.perf_counter() - start, task=name)
+        record_work(work)
+        current_work.reset(token)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        work = WorkStats("unmatched")
+        token = current_work.set(work)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the router puts the matched route into the scope, label by its template not the raw path
+            route = scope.get("route")
+            if route is not None:
+                work.label = route.path
+            http_requests.inc(method=scope["method"], route=work.label, status=status)
+            http_duration.observe(time.perf_counter() - start, method=scope["method"], route=work.label)
+            record_work(work)
+            current_work.reset(token)
+
+
+async def serve_metrics(port: int) -> asyncio.Server:
+    # minimal endpoint for processes without the web app, like the notification dispatcher
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = registry.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, port=port)
+
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return registry.render()
@@ -0,0 +1,85 @@
+from abc import ABC, abstractmethod
+import importlib
+import math
+import time
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException, Request
+
+from auth.models import User
+from auth.user_manager import current_active_user
+from config import (
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_MAX_KEYS,
+    RATE_LIMIT_WRITE_RATE,
+    RATE_LIMIT_WRITE_BURST,
+    RATE_LIMIT_DOWNLOAD_RATE,
+    RATE_LIMIT_DOWNLOAD_BURST,
+)
+from metrics import registry
+
+rate_limited = registry.counter("rate_limited_total", "Requests rejected by the rate limiter")
+
+
+class RateLimitBackend(ABC):
+    # a shared backend (redis) implements this and is set with RATE_LIMIT_BACKEND=module:Class
+    @abstractmethod
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        # takes a token from the bucket; 0 if there was one, else seconds until there is
+        ...
+
+
+class MemoryRateLimiter(RateLimitBackend):
+    # per process, so with several workers a client gets up to workers * rate
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / rate
+        self.buckets[key] = (tokens, now)
+        # the least recently used buckets go first, forgetting one only refills it early
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+def load_backend() -> RateLimitBackend:
+    if not RATE_LIMIT_BACKEND:
+        return MemoryRateLimiter()
+    module, _, name = RATE_LIMIT_BACKEND.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+
+limiter = load_backend()
+
+
+def rate_limit(rate: float, burst: int):
+    # a dependency allowing `burst` requests at once and `rate` per second after that,
+    # per user and route; a rate of 0 turns it off
+    async def dependency(request: Request, user: User = Depends(current_active_user)):
+        if rate <= 0:
+            return
+        route = request.scope.get("route")
+        name = f"{request.method} {getattr(route, 'path', request.url.path)}"
+        wait = await limiter.take(f"{name}:{user.id}", rate, burst)
+        if wait:
+            rate_limited.inc(route=name)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+    return dependency
+
+
+write_limit = rate_limit(RATE_LIMIT_WRITE_RATE, RATE_LIMIT_WRITE_BURST)
+download_limit = rate_limit(RATE_LIMIT_DOWNLOAD_RATE, RATE_LIMIT_DOWNLOAD_BURST)
@@ -0,0 +1,21 @@
+import os
+
+import uvicorn
+
+from config import WEB_HOST, WEB_PORT, WEB_WORKERS, WEB_GRACEFUL_TIMEOUT
+
+if __name__ == "__main__":
+    # each worker is a separate process with its own pools; SIGTERM stops accepting
+    # connections, waits up to WEB_GRACEFUL_TIMEOUT for open requests, then runs
+    # the lifespan shutdown which disposes the engines
+    os.environ["WEB_PROCESSES"] = str(WEB_WORKERS)
+    uvicorn.run(
+        "main:app",
+        host=WEB_HOST,
+        port=WEB_PORT,
+        workers=WEB_WORKERS,
+        loop="uvloop",
+        http="httptools",
+        proxy_headers=True,
+        timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT,
+    )
@@ -0,0 +1,240 @@
+import csv
+import json
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import select, insert, func, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth.models import User
+from auth.user_manager import current_active_user
+from cache import cache
+from ratelimit import write_limit
+from database import get_async_session, replica_session_maker
+from .events import notify_batch
+from .models import Task, Comment, EmailNotification, OutboxMessage, NotificationEvent, TaskStatus
+from .schemas import TaskImport
+from .stats import count_task, count_day
+
+IMPORT_BATCH_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+
+router = APIRouter(
+    prefix="/tasks",
+    tags=["tasks"]
+)
+
+
+async def read_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode()
+    if buffer:
+        yield buffer.decode()
+
+
+async def read_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    async for line in read_lines(stream):
+        if line.strip():
+            yield json.loads(line)
+
+
+async def read_csv(stream: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    header = None
+    record = ""
+    async for line in read_lines(stream):
+        record += line + "\n"
+        # a quoted field with a line break inside continues on the next line
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), None)
+        record = ""
+        if not values:
+            continue
+        if header is None:
+            header = values
+        else:
+            # empty cells fall back to the schema defaults
+            yield {key: value for key, value in zip(header, values) if value}
+
+
+def naive_utc(value: datetime | None, default: datetime) -> datetime:
+    if value is None:
+        return default
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+async def insert_batch(session: AsyncSession, batch: list[TaskImport], user: User, notify: bool):
+    # matched case-insensitively like logins, which also lets it use ix_users_email_lower
+    emails = {email.lower() for item in batch for email in item.watchers}
+    user_ids = {user.email.lower(): user.id}
+    if emails:
+        email = func.lower(User.email)
+        result = await session.execute(select(email, User.id).where(email.in_(emails)))
+        user_ids.update(result.tuples().all())
+        unknown = emails - user_ids.keys()
+        if unknown:
+            raise ValueError(f"Unknown watchers: {', '.join(sorted(unknown))}")
+
+    now = datetime.utcnow()
+    task_rows = []
+    for item in batch:
+        created_at = naive_utc(item.created_at, now)
+        comment_times = [naive_utc(c.created_at, created_at) for c in item.comments]
+        task_rows.append({
+            "headline": item.headline,
+            "description": item.description,
+            "status": item.status,
+            "owner_id": user.id,
+            "created_at": created_at,
+            "comment_count": len(item.comments),
+            "last_activity_at": max([created_at, *comment_times]),
+        })
+    result = await session.execute(
+        insert(Task).returning(Task.id, sort_by_parameter_order=True), task_rows
+    )
+    task_ids = result.scalars().all()
+
+    comment_rows = []
+    subscription_rows = []
+    for task_id, item, row in zip(task_ids, batch, task_rows):
+        for comment in item.comments:
+            comment_rows.append({
+                "text": comment.text,
+                "task_id": task_id,
+                "owner_id": user.id,
+                "created_at": naive_utc(comment.created_at, row["created_at"]),
+            })
+        for watcher_id in dict.fromkeys(user_ids[email.lower()] for email in [user.email, *item.watchers]):
+            subscription_rows.append({"task_id": task_id, "user_id": watcher_id})
+    if comment_rows:
+        await session.execute(insert(Comment), comment_rows)
+    await session.execute(insert(EmailNotification), subscription_rows)
+
+    for status, count in Counter(row["status"] for row in task_rows).items():
+        await count_task(session, user.id, status, count)
+    days = defaultdict(Counter)
+    for row in task_rows:
+        days[row["created_at"].date()]["created"] += 1
+        if row["status"] == TaskStatus.closed:
+            days[row["last_activity_at"].date()]["closed"] += 1
+    for row in comment_rows:
+        days[row["created_at"].date()]["comments"] += 1
+    for day, counts in days.items():
+        await count_day(session, day, **counts)
+
+    if notify:
+        result = await session.execute(insert(OutboxMessage).returning(OutboxMessage.id), [
+            {"task_id": task_id, "event": NotificationEvent.created} for task_id in task_ids
+        ])
+        message_ids = result.scalars().all()
+        await session.execute(notify_batch(min(message_ids), max(message_ids)))
+    await session.commit()
+
+
+@router.post("/import", summary="Import tasks from NDJSON or CSV", dependencies=[Depends(write_limit)])
+async def import_tasks(
+        request: Request,
+        notify: bool = False,
+        session: AsyncSession = Depends(get_async_session),
+        user: User = Depends(current_active_user)):
+    if not user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized to import tasks")
+    if "csv" in request.headers.get("content-type", ""):
+        records = read_csv(request.stream())
+    else:
+        records = read_ndjson(request.stream())
+
+    imported = 0
+    batch = []
+    try:
+        async for record in records:
+            batch.append(TaskImport.model_validate(record))
+            if len(batch) == IMPORT_BATCH_SIZE:
+                await insert_batch(session, batch, user, notify)
+                imported += len(batch)
+                batch = []
+        if batch:
+            await insert_batch(session, batch, user, notify)
+            imported += len(batch)
+    except (ValueError, ValidationError) as e:
+        # earlier batches are already committed, tell the client where to resume
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"Invalid record {imported + len(batch) + 1}: {e}", "imported": imported},
+        )
+    finally:
+        if imported:
+            await cache.invalidate("tasks")
+    return {"status": "OK", "imported": imported}
+
+
+def export_query():
+    comments = (
+        select(func.json_agg(aggregate_order_by(
+            func.json_build_object("text", Comment.text, "created_at", Comment.created_at),
+            Comment.created_at,
+        )))
+        .where(Comment.task_id == Task.id)
+        .scalar_subquery()
+    )
+    watchers = (
+        select(func.json_agg(User.email))
+        .join(EmailNotification, EmailNotification.user_id == User.id)
+        .where(EmailNotification.task_id == Task.id)
+        .scalar_subquery()
+    )
+    empty = literal_column("'[]'::json")
+    return (
+        select(
+            Task.id,
+            Task.headline,
+            Task.description,
+            Task.status,
+            Task.created_at,
+            func.coalesce(comments, empty).label("comments"),
+            func.coalesce(watchers, empty).label("watchers"),
+        )
+        .order_by(Task.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+
+async def export_rows() -> AsyncIterator[bytes]:
+    # the request's session is closed before a streaming body is sent, so use our own
+    async with replica_session_maker() as session:
+        result = await session.stream(export_query())
+        async for partition in result.partitions():
+            yield "".join(
+                json.dumps({
+                    "id": row.id,
+                    "headline": row.headline,
+                    "description": row.description,
+                    "status": row.status.value,
+                    "created_at": row.created_at.isoformat(),
+                    "comments": row.comments,
+                    "watchers": row.watchers,
+                }, ensure_ascii=False) + "\n"
+                for row in partition
+            ).encode()
+
+
+@router.get("/export", summary="Export all tasks as NDJSON")
+async def export_tasks(user: User = Depends(current_active_user)):
+    if not user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized to export tasks")
+    return StreamingResponse(
+        export_rows(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="tasks.ndjson"'},
+    )
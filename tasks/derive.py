@@ -0,0 +1,97 @@
+import importlib.util
+import logging
+import warnings
+
+from config import THUMBNAIL_SIZE, PREVIEW_SIZE, PREVIEW_TEXT_LIMIT, PREVIEW_MAX_PIXELS
+
+# runs in the preview worker processes: only plain paths go in and out, and
+# Pillow and pypdfium2 are optional, without them the matching derivatives are skipped
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 80
+
+
+def save_jpeg(image, path: str, size: int):
+    image = image.copy()
+    image.thumbnail((size, size))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.save(path, "JPEG", quality=JPEG_QUALITY, optimize=True)
+
+
+def derive_image(source: str, targets: dict[str, str]) -> list[str]:
+    from PIL import Image, ImageOps
+
+    # Image.open checks the header size against this, so a decompression bomb is
+    # refused before anything is decoded; Pillow only warns below twice the limit
+    Image.MAX_IMAGE_PIXELS = PREVIEW_MAX_PIXELS
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+    with Image.open(source) as image:
+        # let the decoder downscale large jpegs while reading
+        image.draft("RGB", (PREVIEW_SIZE, PREVIEW_SIZE))
+        image = ImageOps.exif_transpose(image)
+        save_jpeg(image, targets["preview"], PREVIEW_SIZE)
+        save_jpeg(image, targets["thumbnail"], THUMBNAIL_SIZE)
+    return ["preview", "thumbnail"]
+
+
+def derive_pdf(source: str, targets: dict[str, str]) -> list[str]:
+    import pypdfium2
+
+    done = []
+    pdf = pypdfium2.PdfDocument(source)
+    try:
+        # to_pil() needs Pillow, the text can be extracted without it
+        if len(pdf) and importlib.util.find_spec("PIL"):
+            page = pdf[0]
+            # the first page, rendered just large enough for the preview
+            image = page.render(scale=PREVIEW_SIZE / max(page.get_size())).to_pil()
+            save_jpeg(image, targets["preview"], PREVIEW_SIZE)
+            save_jpeg(image, targets["thumbnail"], THUMBNAIL_SIZE)
+            done += ["preview", "thumbnail"]
+        text, size = [], 0
+        for index in range(len(pdf)):
+            chunk = pdf[index].get_textpage().get_text_range()
+            text.append(chunk)
+            size += len(chunk)
+            if size >= PREVIEW_TEXT_LIMIT:
+                break
+        write_text(targets["text"], "\n".join(text))
+        done.append("text")
+    finally:
+        pdf.close()
+    return done
+
+
+def derive_text(source: str, targets: dict[str, str]) -> list[str]:
+    with open(source, "rb") as file:
+        data = file.read(PREVIEW_TEXT_LIMIT)
+    write_text(targets["text"], data.decode("utf-8", errors="replace"))
+    return ["text"]
+
+
+def write_text(path: str, text: str):
+    # cut on characters, the limit is only approximate in bytes
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(text[:PREVIEW_TEXT_LIMIT])
+
+
+def derive(source: str, minetype: str, targets: dict[str, str]) -> list[str]:
+    # writes whatever can be made of the file to targets (kind -> path), returns the kinds written
+    if minetype.startswith("image/"):
+        derivation = derive_image
+    elif minetype == "application/pdf":
+        derivation = derive_pdf
+    elif minetype.startswith("text/"):
+        derivation = derive_text
+    else:
+        return []
+    try:
+        return derivation(source, targets)
+    except ImportError as e:
+        logger.info("No previews for %s: %s", minetype, e)
+    except Exception as e:
+        # a broken or unsupported file just gets no previews
+        logger.warning("Could not derive previews of %s: %r", source, e)
+    return []
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import random
+import signal
+import time
+from datetime import timedelta
+
+from sqlalchemy import select, update, delete, func, or_
+
+from config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_DELAY,
+    OUTBOX_LEASE,
+    OUTBOX_COALESCE,
+    SMTP_POOL_SIZE,
+    DISPATCHER_METRICS_PORT,
+    DISPATCHER_DRAIN_TIMEOUT,
+    DIGEST_WINDOW,
+    DIGEST_MAX_EVENTS,
+    DIGEST_BATCH_SIZE,
+)
+from auth.models import User
+from database import async_session_maker, dispose
+from metrics import track_background, serve_metrics
+from .models import Task, OutboxMessage, DigestItem, NotificationMode, utcnow
+from .outbox import load_recipients
+from .repository import TaskRepository
+from .send_email import SMTPPool, send_email_notification, send_digest
+
+logger = logging.getLogger(__name__)
+
+# failed digests by user: (attempts, monotonic time of the next try)
+digest_backoff: dict[int, tuple[int, float]] = {}
+
+
+def retry_delay(attempts: int) -> float:
+    delay = min(OUTBOX_RETRY_DELAY * 2 ** attempts, OUTBOX_LEASE)
+    return delay * random.uniform(0.5, 1)
+
+
+async def claim_batch() -> list[OutboxMessage]:
+    async with async_session_maker() as session:
+        query = (
+            select(OutboxMessage)
+            .where(OutboxMessage.sent_at.is_(None))
+            .where(OutboxMessage.failed_at.is_(None))
+            .where(OutboxMessage.next_attempt_at <= utcnow)
+            .order_by(OutboxMessage.id)
+            .limit(OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        result = await session.execute(query)
+        messages = result.scalars().all()
+        if messages:
+            # lease the rows so other dispatchers skip them while we send
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_([m.id for m in messages]))
+                .values(next_attempt_at=utcnow + timedelta(seconds=OUTBOX_LEASE))
+            )
+        await session.commit()
+        return messages
+
+
+async def deliver(message: OutboxMessage, pool: SMTPPool, email: bool = True):
+    async with async_session_maker() as session:
+        try:
+            async with track_background("send_email_notification"):
+                recipients = await load_recipients(message.task_id, session)
+                immediate = [r.email for r in recipients if r.notification_mode == NotificationMode.immediate]
+                digest = [r.id for r in recipients if r.notification_mode == NotificationMode.digest]
+                if immediate and email:
+                    task = await TaskRepository(session).aggregate(message.task_id)
+                    if task is not None:
+                        await send_email_notification(task, immediate, pool, key=message.id)
+        except Exception as e:
+            attempts = message.attempts + 1
+            values = {"attempts": attempts, "last_error": repr(e)}
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.error("Giving up on %r after %s attempts: %r", message, attempts, e)
+                values["failed_at"] = utcnow
+            else:
+                logger.warning("Delivery of %r failed, retrying: %r", message, e)
+                values["next_attempt_at"] = utcnow + timedelta(seconds=retry_delay(attempts))
+        else:
+            values = {"sent_at": utcnow, "last_error": None}
+            # queued in the same transaction that marks the message sent
+            session.add_all(
+                DigestItem(user_id=user_id, task_id=message.task_id, event=message.event) for user_id in digest
+            )
+        await session.execute(
+            update(OutboxMessage).where(OutboxMessage.id == message.id).values(**values)
+        )
+        await session.commit()
+
+
+async def release(message_ids: list[int]):
+    async with async_session_maker() as session:
+        await session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(message_ids))
+            .where(OutboxMessage.sent_at.is_(None))
+            .values(next_attempt_at=utcnow)
+        )
+        await session.commit()
+
+
+async def due_digests() -> list[int]:
+    now = time.monotonic()
+    waiting = [user_id for user_id, (_, retry_at) in digest_backoff.items() if retry_at > now]
+    async with async_session_maker() as session:
+        query = (
+            select(DigestItem.user_id)
+            .group_by(DigestItem.user_id)
+            .having(or_(
+                func.min(DigestItem.created_at) <= utcnow - timedelta(seconds=DIGEST_WINDOW),
+                func.count() >= DIGEST_MAX_EVENTS,
+            ))
+            .limit(DIGEST_BATCH_SIZE)
+        )
+        if waiting:
+            query = query.where(DigestItem.user_id.not_in(waiting))
+        result = await session.execute(query)
+        return result.scalars().all()
+
+
+async def flush_digest(user_id: int, pool: SMTPPool) -> bool:
+    async with async_session_maker() as session:
+        # row locks keep a second dispatcher from sending the same items
+        result = await session.execute(
+            select(DigestItem)
+            .where(DigestItem.user_id == user_id)
+            .order_by(DigestItem.id)
+            .with_for_update(skip_locked=True)
+        )
+        items = result.scalars().all()
+        if not items:
+            return False
+        email = await session.scalar(select(User.email).where(User.id == user_id))
+        result = await session.execute(
+            select(Task.id, Task.headline).where(Task.id.in_({item.task_id for item in items}))
+        )
+        headlines = dict(result.tuples().all())
+        try:
+            async with track_background("send_digest"):
+                await send_digest(email, items, headlines, pool)
+        except Exception as e:
+            attempts = digest_backoff.get(user_id, (0, 0))[0] + 1
+            logger.warning("Digest for user %s failed, retrying: %r", user_id, e)
+            digest_backoff[user_id] = (attempts, time.monotonic() + retry_delay(attempts))
+            return False
+        digest_backoff.pop(user_id, None)
+        await session.execute(delete(DigestItem).where(DigestItem.id.in_([item.id for item in items])))
+        await session.commit()
+        return True
+
+
+async def dispatch_once(pool: SMTPPool) -> int:
+    messages = await claim_batch()
+    semaphore = asyncio.Semaphore(pool.size)
+    pending = {m.id for m in messages}
+    # the email shows the task as it is when sent, so of a burst of events on one task
+    # only the latest needs one; the others are marked sent and still go to digests
+    latest = {m.task_id: m.id for m in messages}
+
+    async def bounded(message):
+        async with semaphore:
+            await deliver(message, pool, email=not OUTBOX_COALESCE or latest[message.task_id] == message.id)
+            pending.discard(message.id)
+
+    try:
+        await asyncio.gather(*(bounded(m) for m in messages))
+    except asyncio.CancelledError:
+        # hand unsent messages back right away instead of after the lease runs out
+        if pending:
+            await release(list(pending))
+        raise
+
+    users = await due_digests()
+
+    async def bounded_digest(user_id):
+        async with semaphore:
+            return await flush_digest(user_id, pool)
+
+    flushed = await asyncio.gather(*(bounded_digest(u) for u in users))
+    return len(messages) + sum(flushed)
+
+
+async def run(stop: asyncio.Event):
+    pool = SMTPPool(SMTP_POOL_SIZE)
+    try:
+        while not stop.is_set():
+            if await dispatch_once(pool):
+                continue
+            try:
+                await asyncio.wait_for(stop.wait(), OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await pool.close()
+
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # finish the batch in flight, then exit
+        loop.add_signal_handler(sig, stop.set)
+    server = await serve_metrics(DISPATCHER_METRICS_PORT) if DISPATCHER_METRICS_PORT else None
+    runner = asyncio.create_task(run(stop))
+    try:
+        await asyncio.wait([runner, asyncio.create_task(stop.wait())], return_when=asyncio.FIRST_COMPLETED)
+        try:
+            await asyncio.wait_for(runner, DISPATCHER_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Batch still in flight after %ss, released it to other dispatchers",
+                           DISPATCHER_DRAIN_TIMEOUT)
+    finally:
+        if server is not None:
+            server.close()
+        await dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
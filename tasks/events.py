@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator
+
+import asyncpg
+from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func, event, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import (
+    DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER,
+    EVENTS_QUEUE_SIZE, EVENTS_HEARTBEAT, EVENTS_REPLAY_LIMIT, EVENTS_RECONNECT_DELAY,
+)
+from auth.models import User
+from auth.user_manager import current_active_user
+from database import async_session_maker, get_read_session
+from metrics import registry
+from .models import Task, OutboxMessage, EmailNotification
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "task_events"
+# NOTIFY payloads are limited to 8000 bytes, bigger events are sent as a bare id and loaded
+NOTIFY_LIMIT = 7900
+
+router = APIRouter(
+    prefix="/tasks",
+    tags=["tasks"]
+)
+
+
+def message_event(message: OutboxMessage, users: list[int]) -> dict:
+    return {
+        "id": message.id,
+        "event": message.event.value,
+        "task_id": message.task_id,
+        "users": users,
+    }
+
+
+def watchers(task_id):
+    return select(EmailNotification.user_id).where(EmailNotification.task_id == task_id)
+
+
+@event.listens_for(OutboxMessage, "after_insert")
+def notify_listeners(mapper, connection, target: OutboxMessage):
+    # NOTIFY is transactional, listeners only hear about it once the write commits
+    users = connection.execute(watchers(target.task_id)).scalars().all()
+    payload = json.dumps(message_event(target, users))
+    if len(payload.encode()) > NOTIFY_LIMIT:
+        payload = json.dumps({"id": target.id})
+    connection.execute(select(func.pg_notify(CHANNEL, payload)))
+
+
+def notify_batch(first_id: int, last_id: int):
+    # bulk inserts skip after_insert; one NOTIFY covers the batch and listeners load its rows
+    return select(func.pg_notify(CHANNEL, json.dumps({"id": last_id, "first_id": first_id})))
+
+
+async def load_events(
+        last_id: int,
+        task_id: int | None = None,
+        user_id: int | None = None,
+        limit: int = EVENTS_REPLAY_LIMIT,
+        ) -> list[dict]:
+    # the primary, a replica may not have the rows yet when the notification arrives
+    async with async_session_maker() as session:
+        users = func.array(watchers(OutboxMessage.task_id).scalar_subquery(), type_=ARRAY(Integer))
+        query = (
+            select(OutboxMessage, users)
+            .where(OutboxMessage.id > last_id)
+            .order_by(OutboxMessage.id)
+            .limit(limit)
+        )
+        if task_id is not None:
+            query = query.where(OutboxMessage.task_id == task_id)
+        if user_id is not None:
+            query = query.where(
+                watchers(OutboxMessage.task_id).where(EmailNotification.user_id == user_id).exists()
+            )
+        result = await session.execute(query)
+        return [message_event(message, users) for message, users in result]
+
+
+class Subscription(asyncio.Queue):
+    def __init__(self):
+        super().__init__(EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class Broker:
+    def __init__(self):
+        self.subscriptions: set[Subscription] = set()
+        self.last_id = 0
+        self.listener: asyncio.Task | None = None
+        self.pending: set[asyncio.Task] = set()
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription()
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, data: dict):
+        self.last_id = max(self.last_id, data["id"])
+        for subscription in list(self.subscriptions):
+            try:
+                subscription.put_nowait(data)
+            except asyncio.QueueFull:
+                # a client that can't keep up is cut off and resumes from its Last-Event-ID
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+
+    async def publish_range(self, first_id: int, last_id: int):
+        after = first_id - 1
+        while after < last_id:
+            events = await load_events(after, limit=min(EVENTS_REPLAY_LIMIT, last_id - after))
+            for data in events:
+                if data["id"] <= last_id:
+                    self.publish(data)
+            if not events:
+                break
+            after = events[-1]["id"]
+
+    def on_notify(self, connection, pid, channel, payload):
+        data = json.loads(payload)
+        if "event" in data:
+            self.publish(data)
+        else:
+            task = asyncio.create_task(self.publish_range(data.get("first_id", data["id"]), data["id"]))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def catch_up(self):
+        # events committed while the listener was disconnected
+        while events := await load_events(self.last_id):
+            for data in events:
+                self.publish(data)
+            if len(events) < EVENTS_REPLAY_LIMIT:
+                break
+
+    async def listen(self):
+        while True:
+            try:
+                connection = await asyncpg.connect(
+                    user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, database=DB_NAME
+                )
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Cannot listen for task events, retrying: %r", e)
+                await asyncio.sleep(EVENTS_RECONNECT_DELAY)
+                continue
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            try:
+                await connection.add_listener(CHANNEL, self.on_notify)
+                if self.last_id:
+                    await self.catch_up()
+                else:
+                    self.last_id = await connection.fetchval("SELECT coalesce(max(id), 0) FROM outboxmessages")
+                await closed.wait()
+                logger.warning("Task events listener disconnected, reconnecting")
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Task events listener failed, reconnecting: %r", e)
+                await asyncio.sleep(EVENTS_RECONNECT_DELAY)
+            finally:
+                await connection.close()
+
+    def start(self):
+        self.listener = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+        # wake every open stream so the responses finish
+        for subscription in list(self.subscriptions):
+            subscription.overflowed = True
+            self.unsubscribe(subscription)
+            try:
+                subscription.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+
+broker = Broker()
+
+subscribers = registry.gauge("events_subscribers", "Open task event streams")
+
+
+@registry.collector
+def collect_events():
+    subscribers.set(len(broker.subscriptions))
+
+
+def format_event(data: dict) -> str:
+    # watchers are only used for routing, clients don't see who else follows a task
+    body = json.dumps({"id": data["id"], "event": data["event"], "task_id": data["task_id"]})
+    return f"id: {data['id']}\nevent: {data['event']}\ndata: {body}\n\n"
+
+
+async def event_stream(last_id: int | None, task_id: int | None, user_id: int | None) -> AsyncIterator[str]:
+    # subscribe before replaying so nothing committed in between is lost
+    subscription = broker.subscribe()
+    try:
+        yield f"retry: {int(EVENTS_RECONNECT_DELAY * 1000)}\n\n"
+        replayed = set()
+        if last_id is not None:
+            while events := await load_events(last_id, task_id, user_id):
+                for data in events:
+                    replayed.add(data["id"])
+                    yield format_event(data)
+                last_id = events[-1]["id"]
+                if len(events) < EVENTS_REPLAY_LIMIT:
+                    break
+        while not subscription.overflowed:
+            try:
+                data = await asyncio.wait_for(subscription.get(), EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if data is None or data["id"] in replayed:
+                continue
+            if task_id is not None and data["task_id"] != task_id:
+                continue
+            if user_id is not None and user_id not in data["users"]:
+                continue
+            yield format_event(data)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def event_response(stream: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
+
+
+@router.get("/events", summary="Stream events for the tasks you follow")
+async def my_events(
+        last_event_id: int | None = Header(None),
+        user: User = Depends(current_active_user)):
+    return event_response(event_stream(last_event_id, None, user.id))
+
+
+@router.get("/{task_id}/events", summary="Stream events for a task")
+async def task_events(
+        task_id: int,
+        last_event_id: int | None = Header(None),
+        session: AsyncSession = Depends(get_read_session),
+        user: User = Depends(current_active_user)):
+    if await session.scalar(select(Task.id).filter_by(id=task_id)) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return event_response(event_stream(last_event_id, task_id, None))
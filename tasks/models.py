@@ -2,18 +2,41 @@ import datetime
 import enum
 from typing import Annotated, Optional
 
-from sqlalchemy import String, ForeignKey, text
+from sqlalchemy import String, ForeignKey, text, Computed, Index, UniqueConstraint, func, literal_column
+from sqlalchemy.dialects.postgresql import TSVECTOR, ARRAY
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from database import Base
 
 created_at = Annotated[datetime.datetime, mapped_column(server_default=text("TIMEZONE('utc', now())"))]
 
+SEARCH_CONFIG = literal_column("'simple'")
+
+utcnow = func.timezone("utc", func.now())
+
 
 class TaskStatus(enum.Enum):
     open = "open"
     closed = "closed"
 
 
+class NotificationEvent(enum.Enum):
+    created = "created"
+    commented = "commented"
+    closed = "closed"
+    uploaded = "uploaded"
+
+
+class NotificationMode(enum.Enum):
+    immediate = "immediate"
+    digest = "digest"
+
+
+class PreviewKind(enum.Enum):
+    thumbnail = "thumbnail"
+    preview = "preview"
+    text = "text"
+
+
 class Task(Base):
     __tablename__ = "tasks"
 
@@ -23,10 +46,12 @@ class Task(Base):
     status: Mapped[TaskStatus] = mapped_column(default=TaskStatus.open)
     created_at: Mapped[created_at]
     owner_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
+    comment_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    last_activity_at: Mapped[created_at]
     comments: Mapped[Optional[list["Comment"]]] = relationship(
         back_populates="task",
     )
-    file: Mapped[Optional["TaskFile"]] = relationship(
+    files: Mapped[Optional[list["TaskFile"]]] = relationship(
         back_populates="task",
     )
     owner: Mapped["User"] = relationship(
@@ -35,6 +60,29 @@ class Task(Base):
     emails: Mapped[Optional[list["EmailNotification"]]] = relationship(
         back_populates="task",
     )
+    search_vector: Mapped[Optional[str]] = mapped_column(
+        TSVECTOR,
+        Computed(
+            "setweight(to_tsvector('simple', coalesce(headline, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(description, '')), 'B')",
+            persisted=True,
+        ),
+        deferred=True,
+    )
+
+    __table_args__ = (
+        Index("ix_tasks_search_vector", "search_vector", postgresql_using="gin"),
+        # keyset pages of GET /tasks/ and /my_tasks, newest first
+        Index("ix_tasks_created_at_id", text("created_at DESC"), text("id DESC")),
+        Index("ix_tasks_owner_id_created_at_id", "owner_id", text("created_at DESC"), text("id DESC")),
+        # open tasks are the usual status filter and a small share of all tasks
+        Index(
+            "ix_tasks_open_created_at_id",
+            text("created_at DESC"),
+            text("id DESC"),
+            postgresql_where=text("status = 'open'"),
+        ),
+    )
 
     def __repr__(self):
         return f"Task#{self.id}"
@@ -46,7 +94,7 @@ class Comment(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     text: Mapped[str]
     task_id: Mapped[Optional[int]] = mapped_column(ForeignKey("tasks.id", ondelete="CASCADE"))
-    owner_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
+    owner_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"), index=True)
     created_at: Mapped[created_at]
     task: Mapped["Task"] = relationship(
         back_populates="comments",
@@ -55,24 +103,47 @@ class Comment(Base):
         back_populates="comments", lazy='selectin'
     )
 
+    __table_args__ = (
+        Index("ix_comments_task_id_created_at", "task_id", "created_at", "id"),
+        Index(
+            "ix_comments_search_vector",
+            func.to_tsvector(SEARCH_CONFIG, literal_column("text")),
+            postgresql_using="gin",
+        ),
+    )
+
     def __repr__(self):
         return self.text
 
+
+comment_search_vector = func.to_tsvector(SEARCH_CONFIG, Comment.text)
+
+
 class TaskFile(Base):
     __tablename__= "taskfiles"
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(200))
     minetype: Mapped[str] = mapped_column(String(100))
+    sha256: Mapped[Optional[str]] = mapped_column(String(64), index=True)
+    size: Mapped[Optional[int]]
+    created_at: Mapped[created_at]
+    # kinds of PreviewKind derived from the content, NULL until the derivation has run
+    previews: Mapped[Optional[list[str]]] = mapped_column(ARRAY(String(20)))
     task_id: Mapped[Optional[int]] = mapped_column(ForeignKey("tasks.id", ondelete="CASCADE"))
-    owner_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
+    owner_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"), index=True)
     task: Mapped["Task"] = relationship(
-        back_populates="file",
+        back_populates="files",
     )
     owner: Mapped["User"] = relationship(
         back_populates="files"
     )
 
+    __table_args__ = (
+        # attachments of a task in upload order
+        Index("ix_taskfiles_task_id_id", "task_id", "id"),
+    )
+
     def __repr__(self):
         return self.name
 
@@ -81,11 +152,92 @@ class EmailNotification(Base):
     __tablename__ = "emailnotifications"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    email: Mapped[str]
-    task_id: Mapped[Optional[int]] = mapped_column(ForeignKey("tasks.id", ondelete="CASCADE"))
+    task_id: Mapped[int] = mapped_column(ForeignKey("tasks.id", ondelete="CASCADE"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
     task: Mapped["Task"] = relationship(
         back_populates="emails",
     )
+    user: Mapped["User"] = relationship()
+
+    __table_args__ = (
+        # one subscription per user and task; also serves "who watches this task"
+        UniqueConstraint("task_id", "user_id", name="uq_emailnotifications_task_id_user_id"),
+        # "which tasks does this user watch"
+        Index("ix_emailnotifications_user_id_task_id", "user_id", "task_id"),
+    )
+
+    def __repr__(self):
+        return f"user {self.user_id}"
+
+
+class DigestItem(Base):
+    __tablename__ = "digestitems"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    task_id: Mapped[int] = mapped_column(ForeignKey("tasks.id", ondelete="CASCADE"), index=True)
+    event: Mapped[NotificationEvent]
+    created_at: Mapped[created_at]
+
+    __table_args__ = (
+        Index("ix_digestitems_user_id_created_at", "user_id", "created_at"),
+    )
+
+
+class TaskStatusCount(Base):
+    __tablename__ = "taskstatuscounts"
+
+    # every write bumps one of a few shards so concurrent writers don't queue on one row
+    status: Mapped[TaskStatus] = mapped_column(primary_key=True)
+    shard: Mapped[int] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(default=0)
+
+
+class OwnerTaskCount(Base):
+    __tablename__ = "ownertaskcounts"
+
+    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    status: Mapped[TaskStatus] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(default=0)
+
+    __table_args__ = (
+        # owners with the most open tasks
+        Index("ix_ownertaskcounts_status_count", "status", "count"),
+    )
+
+
+class DailyTaskCount(Base):
+    __tablename__ = "dailytaskcounts"
+
+    day: Mapped[datetime.date] = mapped_column(primary_key=True)
+    shard: Mapped[int] = mapped_column(primary_key=True)
+    created: Mapped[int] = mapped_column(default=0)
+    closed: Mapped[int] = mapped_column(default=0)
+    comments: Mapped[int] = mapped_column(default=0)
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outboxmessages"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    event: Mapped[NotificationEvent]
+    task_id: Mapped[Optional[int]] = mapped_column(ForeignKey("tasks.id", ondelete="CASCADE"))
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[created_at]
+    created_at: Mapped[created_at]
+    sent_at: Mapped[Optional[datetime.datetime]]
+    failed_at: Mapped[Optional[datetime.datetime]]
+    last_error: Mapped[Optional[str]]
+
+    __table_args__ = (
+        Index(
+            "ix_outboxmessages_pending",
+            "next_attempt_at",
+            postgresql_where=text("sent_at IS NULL AND failed_at IS NULL"),
+        ),
+        # event replay for one task
+        Index("ix_outboxmessages_task_id_id", "task_id", "id"),
+    )
 
     def __repr__(self):
-        return self.email
\ No newline at end of file
+        return f"OutboxMessage#{self.id}"
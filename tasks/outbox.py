@@ -0,0 +1,30 @@
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth.models import User
+from .models import OutboxMessage, NotificationEvent, EmailNotification
+
+
+async def subscribe(session: AsyncSession, task_id: int, user_id: int):
+    # the unique key makes this safe against concurrent comments by the same user
+    await session.execute(
+        insert(EmailNotification)
+        .values(task_id=task_id, user_id=user_id)
+        .on_conflict_do_nothing(constraint="uq_emailnotifications_task_id_user_id")
+    )
+
+
+def enqueue_notification(session: AsyncSession, task_id: int, event: NotificationEvent):
+    # written in the caller's transaction, the dispatcher picks it up after commit
+    session.add(OutboxMessage(task_id=task_id, event=event))
+
+
+async def load_recipients(task_id: int, session: AsyncSession):
+    # whoever watches the task when the message goes out
+    result = await session.execute(
+        select(User.id, User.email, User.notification_mode)
+        .join(EmailNotification, EmailNotification.user_id == User.id)
+        .where(EmailNotification.task_id == task_id)
+    )
+    return result.all()
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import aiofiles.os
+from fastapi import HTTPException
+from sqlalchemy import update
+from starlette.requests import Request
+from starlette.responses import Response
+
+from cache import cache
+from config import PREVIEW_WORKERS, PREVIEW_MAX_AGE, PREVIEW_QUEUE_SIZE
+from database import async_session_maker
+from metrics import track_background
+from .derive import derive
+from .models import TaskFile, PreviewKind
+from .schemas import TaskFileRead
+from .storage import storage, content_key
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {
+    PreviewKind.thumbnail: "image/jpeg",
+    PreviewKind.preview: "image/jpeg",
+    PreviewKind.text: "text/plain; charset=utf-8",
+}
+EXTENSIONS = {PreviewKind.thumbnail: ".jpg", PreviewKind.preview: ".jpg", PreviewKind.text: ".txt"}
+
+
+def new_executor() -> ProcessPoolExecutor:
+    # decoding images and pdfs is CPU bound and holds the GIL, so it runs in processes.
+    # They are spawned rather than forked, so they don't inherit the server's loop, pools and threads
+    return ProcessPoolExecutor(PREVIEW_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+executor = new_executor()
+
+# derivations in flight by content hash, requests for the same content wait for the same run.
+# Bounded by PREVIEW_QUEUE_SIZE: past it uploads skip the derivation and views get a 503 with Retry-After
+running: dict[str, asyncio.Task] = {}
+
+
+def preview_key(sha256: str, kind: PreviewKind) -> str:
+    # stored next to the content they are made of
+    return f"{content_key(sha256)}.{kind.value}"
+
+
+async def run_derive(source: str, minetype: str, targets: dict[str, str]) -> list[str]:
+    global executor
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = executor
+        try:
+            return await loop.run_in_executor(pool, derive, source, minetype, targets)
+        except BrokenProcessPool:
+            # a worker died (a crash in a decoder, out of memory) and took the pool down with it,
+            # so start a new one. Every derivation in flight fails with it, each gets one more try;
+            # the file that killed the pool kills the second one too and ends up with no previews
+            if executor is pool:
+                logger.error("Preview worker died, restarting the pool")
+                executor = new_executor()
+                pool.shutdown(wait=False, cancel_futures=True)
+            if attempt:
+                raise
+
+
+async def derive_previews(sha256: str, minetype: str) -> list[str]:
+    async with track_background("derive_previews"):
+        await aiofiles.os.makedirs(storage.tmp_dir, exist_ok=True)
+        targets = {kind.value: os.path.join(storage.tmp_dir, uuid.uuid4().hex) for kind in PreviewKind}
+        try:
+            async with storage.local_copy(content_key(sha256)) as source:
+                kinds = await run_derive(source, minetype, targets)
+            for kind in kinds:
+                await storage.put(targets.pop(kind), preview_key(sha256, PreviewKind(kind)))
+        except Exception as e:
+            # recorded as having no previews, so views don't start it over every time
+            logger.error("Deriving previews of %s failed: %r", sha256, e)
+            kinds = []
+        finally:
+            for path in targets.values():
+                if await aiofiles.os.path.exists(path):
+                    await aiofiles.os.remove(path)
+
+        async with async_session_maker() as session:
+            result = await session.execute(
+                update(TaskFile).where(TaskFile.sha256 == sha256).values(previews=kinds).returning(TaskFile.task_id)
+            )
+            task_ids = set(result.scalars())
+            await session.commit()
+    # the task and its file list show the previews right away; cached list pages are
+    # left alone, so they don't all drop on every upload, and catch up within CACHE_TTL
+    for task_id in task_ids:
+        await cache.invalidate(f"task:{task_id}")
+    return kinds
+
+
+def finished(sha256: str, task: asyncio.Task):
+    running.pop(sha256, None)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Deriving previews of %s failed: %r", sha256, task.exception())
+
+
+def schedule(sha256: str, minetype: str | None) -> asyncio.Task | None:
+    task = running.get(sha256)
+    if task is None:
+        if len(running) >= PREVIEW_QUEUE_SIZE:
+            return None
+        task = asyncio.create_task(derive_previews(sha256, minetype or ""))
+        task.add_done_callback(lambda task: finished(sha256, task))
+        running[sha256] = task
+    return task
+
+
+async def ensure(taskfile: TaskFile | TaskFileRead) -> list[str]:
+    if taskfile.previews is not None:
+        return taskfile.previews
+    # derived on first use when the run after upload was lost or skipped; shielded so
+    # a client that goes away doesn't cancel work other requests wait for
+    task = schedule(taskfile.sha256, taskfile.minetype)
+    if task is None:
+        raise HTTPException(status_code=503, detail="Previews are busy", headers={"Retry-After": "5"})
+    return await asyncio.shield(task)
+
+
+async def preview_response(request: Request, taskfile: TaskFile | TaskFileRead, kind: PreviewKind) -> Response:
+    # a file never changes once uploaded, so its previews can be cached for good
+    name = os.path.splitext(taskfile.name)[0] + EXTENSIONS[kind]
+    return await storage.serve(
+        request,
+        preview_key(taskfile.sha256, kind),
+        name,
+        MEDIA_TYPES[kind],
+        f'"{taskfile.sha256}-{kind.value}"',
+        cache_control=f"private, max-age={PREVIEW_MAX_AGE}, immutable",
+        disposition="inline",
+    )
+
+
+async def stop():
+    tasks = list(running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.to_thread(executor.shutdown, cancel_futures=True)
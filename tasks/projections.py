@@ -0,0 +1,109 @@
+from pydantic import TypeAdapter
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth.models import User
+from .models import Task, Comment, TaskFile
+from .schemas import TaskRel, TaskPage, TaskSummaryPage, CommentPage, TaskFileRead
+
+# responses are built from plain column tuples instead of ORM objects, the
+# models below only validate and serialize, so the JSON stays the same
+TASK_COLUMNS = (
+    Task.headline, Task.description, Task.id, Task.status, Task.created_at, Task.comment_count,
+    Task.last_activity_at,
+)
+COMMENT_COLUMNS = (Comment.text, Comment.task_id, Comment.id, Comment.created_at)
+FILE_COLUMNS = (
+    TaskFile.name, TaskFile.minetype, TaskFile.task_id, TaskFile.id, TaskFile.size, TaskFile.sha256,
+    TaskFile.created_at, TaskFile.previews,
+)
+USER_COLUMNS = (
+    User.id, User.email, User.username, User.is_active, User.is_superuser, User.is_verified,
+    User.notification_mode,
+)
+# labelled so they don't clash with the id of the row they belong to
+OWNER_COLUMNS = tuple(column.label(f"owner_{column.key}") for column in USER_COLUMNS)
+
+TASK_KEYS = tuple(column.key for column in TASK_COLUMNS)
+COMMENT_KEYS = tuple(column.key for column in COMMENT_COLUMNS)
+FILE_KEYS = tuple(column.key for column in FILE_COLUMNS)
+USER_KEYS = tuple(column.key for column in USER_COLUMNS)
+
+task_rel = TypeAdapter(TaskRel)
+task_page = TypeAdapter(TaskPage)
+task_summary_page = TypeAdapter(TaskSummaryPage)
+comment_page = TypeAdapter(CommentPage)
+file_list = TypeAdapter(list[TaskFileRead])
+
+
+def project_tasks(query: Select) -> Select:
+    # keeps the filters and joins of a select(Task) query, swaps the ORM entity for columns
+    return (
+        query
+        .with_only_columns(*TASK_COLUMNS, *OWNER_COLUMNS)
+        .outerjoin(User, User.id == Task.owner_id)
+    )
+
+
+def project_comments(query: Select) -> Select:
+    return (
+        query
+        .with_only_columns(*COMMENT_COLUMNS, *OWNER_COLUMNS)
+        .outerjoin(User, User.id == Comment.owner_id)
+    )
+
+
+def owner_record(values) -> dict | None:
+    if values[0] is None:
+        return None
+    return dict(zip(USER_KEYS, values))
+
+
+def comment_record(row) -> dict:
+    size = len(COMMENT_KEYS)
+    record = dict(zip(COMMENT_KEYS, row[:size]))
+    record["owner"] = owner_record(row[size:])
+    return record
+
+
+async def load_files(session: AsyncSession, task_ids: list[int]) -> dict[int, list[dict]]:
+    # size and hash come from the rows, the storage is not touched
+    result = await session.execute(
+        select(*FILE_COLUMNS)
+        .where(TaskFile.task_id.in_(task_ids))
+        .order_by(TaskFile.task_id, TaskFile.id)
+    )
+    files = {}
+    for row in result:
+        files.setdefault(row.task_id, []).append(dict(zip(FILE_KEYS, row)))
+    return files
+
+
+async def load_comments(session: AsyncSession, task_ids: list[int]) -> dict[int, list[dict]]:
+    query = project_comments(
+        select(Comment)
+        .where(Comment.task_id.in_(task_ids))
+        .order_by(Comment.task_id, Comment.created_at, Comment.id)
+    )
+    comments = {}
+    for row in await session.execute(query):
+        comments.setdefault(row.task_id, []).append(comment_record(row))
+    return comments
+
+
+async def task_records(session: AsyncSession, rows, with_comments: bool) -> list[dict]:
+    if not rows:
+        return []
+    task_ids = [row.id for row in rows]
+    files = await load_files(session, task_ids)
+    comments = await load_comments(session, task_ids) if with_comments else None
+    size = len(TASK_KEYS)
+    records = []
+    for row in rows:
+        record = dict(zip(TASK_KEYS, row[:size]))
+        record["owner"] = owner_record(row[size:])
+        record["files"] = files.get(record["id"], [])
+        if comments is not None:
+            record["comments"] = comments.get(record["id"], [])
+        records.append(record)
+    return records
@@ -0,0 +1,98 @@
+from typing import NamedTuple
+
+from fastapi import Depends
+from sqlalchemy import select, update, delete, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_session, get_read_session
+from .models import Task, TaskFile, TaskStatus, utcnow
+from .projections import project_tasks, task_records, load_files
+from .schemas import TaskRel
+
+
+class TaskState(NamedTuple):
+    id: int
+    owner_id: int | None
+    status: TaskStatus
+
+
+class TaskRepository:
+    # one per request; rows read once are served again from memory
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.states: dict[int, TaskState | None] = {}
+
+    async def state(self, task_id: int, lock: bool = False) -> TaskState | None:
+        if not lock and task_id in self.states:
+            return self.states[task_id]
+        query = select(Task.id, Task.owner_id, Task.status).where(Task.id == task_id)
+        if lock:
+            query = query.with_for_update()
+        row = (await self.session.execute(query)).first()
+        self.states[task_id] = state = TaskState(*row) if row else None
+        return state
+
+    async def exists(self, task_id: int) -> bool:
+        if task_id in self.states:
+            return self.states[task_id] is not None
+        return await self.session.scalar(select(exists().where(Task.id == task_id)))
+
+    async def aggregate(self, task_id: int) -> TaskRel | None:
+        # task, owner, latest file and comments as plain data, usable after the session is gone
+        result = await self.session.execute(project_tasks(select(Task).where(Task.id == task_id)))
+        records = await task_records(self.session, result.all(), with_comments=True)
+        return TaskRel.model_validate(records[0]) if records else None
+
+    async def latest_file(self, task_id: int) -> TaskFile | None:
+        result = await self.session.execute(
+            select(TaskFile)
+            .where(TaskFile.task_id == task_id)
+            .order_by(TaskFile.id.desc())
+            .limit(1)
+        )
+        return result.scalars().first()
+
+    async def file(self, task_id: int, file_id: int) -> TaskFile | None:
+        result = await self.session.execute(
+            select(TaskFile).where(TaskFile.id == file_id, TaskFile.task_id == task_id)
+        )
+        return result.scalars().first()
+
+    async def derived_previews(self, sha256: str) -> list[str] | None:
+        # previews belong to the content, another upload of the same bytes already has them
+        return await self.session.scalar(
+            select(TaskFile.previews).where(TaskFile.sha256 == sha256, TaskFile.previews.is_not(None)).limit(1)
+        )
+
+    async def files(self, task_id: int) -> list[dict]:
+        return (await load_files(self.session, [task_id])).get(task_id, [])
+
+    async def touch(self, task_id: int, comments: int = 0):
+        values = {"last_activity_at": utcnow}
+        if comments:
+            values["comment_count"] = Task.comment_count + comments
+        await self.session.execute(update(Task).where(Task.id == task_id).values(**values))
+
+    async def close(self, task_id: int):
+        await self.session.execute(
+            update(Task).where(Task.id == task_id).values(status=TaskStatus.closed, last_activity_at=utcnow)
+        )
+        state = self.states.get(task_id)
+        if state is not None:
+            self.states[task_id] = state._replace(status=TaskStatus.closed)
+
+    async def delete(self, task_id: int) -> TaskState | None:
+        result = await self.session.execute(
+            delete(Task).where(Task.id == task_id).returning(Task.id, Task.owner_id, Task.status)
+        )
+        row = result.first()
+        self.states[task_id] = None
+        return TaskState(*row) if row else None
+
+
+async def get_task_repository(session: AsyncSession = Depends(get_async_session)) -> TaskRepository:
+    return TaskRepository(session)
+
+
+async def get_read_task_repository(session: AsyncSession = Depends(get_read_session)) -> TaskRepository:
+    return TaskRepository(session)
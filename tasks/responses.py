@@ -0,0 +1,135 @@
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+
+import aiofiles.os
+import anyio
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+
+class RangeFileResponse(FileResponse):
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, offset: int, length: int, **kwargs):
+        super().__init__(path, **kwargs)
+        self.offset = offset
+        self.length = length
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or not self.length:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopy" in scope.get("extensions", {}):
+            # the server hands the file to sendfile(2), nothing is copied through python
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.offset)
+            remaining = self.length
+            while remaining:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    # only a single range is honoured, anything else gets the whole file
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start, _, end = ranges.strip().partition("-")
+    try:
+        if not start:
+            length = int(end)
+            if length <= 0:
+                raise ValueError
+            return max(size - length, 0), size - 1
+        first = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if end and first > last:
+        return None
+    return first, min(last, size - 1)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def file_response(
+        request: Request,
+        path: str,
+        filename: str,
+        etag: str | None,
+        media_type: str,
+        cache_control: str = "private, no-cache",
+        disposition: str = "attachment",
+        ) -> Response:
+    try:
+        stat = await aiofiles.os.stat(path)
+    except FileNotFoundError:
+        # the row outlived its content, e.g. a legacy file that was never backfilled
+        raise HTTPException(status_code=404, detail="File not found")
+    if etag is None:
+        etag = f'W/"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        "accept-ranges": "bytes",
+        "cache-control": cache_control,
+    }
+    if not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    size = stat.st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            if start >= size:
+                return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            return RangeFileResponse(path, start, end - start + 1, status_code=206, headers=headers,
+                                     media_type=media_type, filename=filename, content_disposition_type=disposition)
+    return RangeFileResponse(path, 0, size, headers=headers, media_type=media_type, filename=filename,
+                             content_disposition_type=disposition)
+
+
+def json_response(request: Request, payload: bytes) -> Response:
+    etag = f'"{hashlib.blake2b(payload, digest_size=16).hexdigest()}"'
+    headers = {"etag": etag, "cache-control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(payload, media_type="application/json", headers=headers)
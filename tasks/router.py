@@ -1,20 +1,29 @@
-import shutil
 from typing import List, Generator
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks, Request
-from fastapi.responses import FileResponse
-from sqlalchemy import select, insert, delete
-from sqlalchemy.exc import NoResultFound
+from fastapi import APIRouter, Depends, HTTPException, Request, Query, Response
+from sqlalchemy import select, insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload, joinedload
 # from starlette.requests import Request
 
 from auth.user_manager import current_active_user
-from database import get_async_session
-from .models import Task, Comment, TaskFile, EmailNotification, TaskStatus
-from .schemas import TaskRel, TaskAdd, CommentAdd, CommentRead, CommentRel
+from cache import cache
+from ratelimit import write_limit, download_limit
+from database import async_session_maker, engines, get_async_session, get_read_session
+from .models import Task, Comment, TaskFile, EmailNotification, TaskStatus, NotificationEvent, PreviewKind
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset, split_page
+from .search import search_tasks
+from .projections import (
+    project_tasks, project_comments, task_records, comment_record,
+    task_rel, task_page, task_summary_page, comment_page, file_list,
+)
+from .schemas import TaskRel, TaskAdd, CommentAdd, CommentRead, CommentRel, TaskPage, TaskSummaryPage, CommentPage, TaskStats, TaskFileRead
 from auth.models import User
-from .send_email import send_email_notification
+from .outbox import enqueue_notification, subscribe
+from .stats import count_task, count_day, get_stats
+from .repository import TaskRepository, get_task_repository, get_read_task_repository
+from .responses import json_response
+from .storage import receive_upload, check_upload_size, storage
+from .previews import schedule as schedule_previews, ensure as ensure_previews, preview_response
 
 router = APIRouter(
     prefix="/tasks",
@@ -22,225 +31,371 @@ router = APIRouter(
 )
 
 
-@router.get("/", response_model=List[TaskRel])
+async def cached_json(
+        request: Request, namespace: str, scope: str, key: str, render, session: AsyncSession,
+        ) -> Response:
+    payload = await cache.get(namespace, key)
+    if payload is None:
+        if "replica" in engines and await cache.recently_written(scope):
+            # the replica may not have the write that bumped the generation yet,
+            # so a render from it would cache the old data under the new key
+            async with async_session_maker() as primary:
+                payload = await render(primary)
+        else:
+            payload = await render(session)
+        await cache.set(key, payload)
+    return json_response(request, payload)
+
+
+async def invalidate_task(task_id: int):
+    await cache.invalidate("tasks")
+    await cache.invalidate(f"task:{task_id}")
+
+
+async def get_task_page(
+        query,
+        session: AsyncSession,
+        task_filter: str | None,
+        cursor: str | None,
+        limit: int,
+        summary: bool,
+        ):
+    query = project_tasks(query)
+    if task_filter:
+        # search results are ordered by rank, so they come as a single page
+        query = search_tasks(query, task_filter).limit(limit)
+        result = await session.execute(query)
+        rows, next_cursor = result.all(), None
+    else:
+        query = keyset(query, Task.created_at, Task.id, cursor, limit)
+        result = await session.execute(query)
+        rows, next_cursor = split_page(result.all(), limit)
+    items = await task_records(session, rows, with_comments=not summary)
+    page = task_summary_page if summary else task_page
+    return page.dump_json(page.validate_python({"items": items, "next_cursor": next_cursor}))
+
+
+@router.get("/", response_model=TaskPage | TaskSummaryPage)
 async def get_tasks(
         request: Request,
         task_filter: str = None,
         task_status: TaskStatus = None,
-        session: AsyncSession = Depends(get_async_session),
+        cursor: str = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        summary: bool = False,
+        session: AsyncSession = Depends(get_read_session),
         ):
-    query = (
-        select(Task)
-        .options(joinedload(Task.file))
-        .options(joinedload(Task.owner))
-        .options(selectinload(Task.comments))
-    )
-    if task_filter:
-        query = query.filter(Task.headline.icontains(task_filter))
+    query = select(Task)
     if task_status:
         query = query.filter_by(status=task_status)
-    result = await session.execute(query)
-    tasks = result.scalars().all()
-    return tasks
+    key = f"tasks:{await cache.generation('tasks')}:{request.url.query}"
+    return await cached_json(
+        request, "tasks", "tasks", key,
+        lambda session: get_task_page(query, session, task_filter, cursor, limit, summary),
+        session,
+    )
 
 
-@router.get("/my_tasks", response_model=List[TaskRel], )
+@router.get("/my_tasks", response_model=TaskPage | TaskSummaryPage)
 async def get_tasks(
+        request: Request,
         task_filter: str = None,
         task_status: TaskStatus = None,
-        session: AsyncSession = Depends(get_async_session),
+        cursor: str = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        summary: bool = False,
+        session: AsyncSession = Depends(get_read_session),
+        user: User = Depends(current_active_user)
+        ):
+    query = select(Task).filter_by(owner_id=user.id)
+    if task_status:
+        query = query.filter_by(status=task_status)
+    key = f"tasks:{await cache.generation('tasks')}:user:{user.id}:{request.url.query}"
+    return await cached_json(
+        request, "tasks", "tasks", key,
+        lambda session: get_task_page(query, session, task_filter, cursor, limit, summary),
+        session,
+    )
+
+
+@router.get("/watching", response_model=TaskPage | TaskSummaryPage)
+async def get_watched_tasks(
+        request: Request,
+        task_filter: str = None,
+        task_status: TaskStatus = None,
+        cursor: str = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        summary: bool = False,
+        session: AsyncSession = Depends(get_read_session),
         user: User = Depends(current_active_user)
         ):
     query = (
-        select(Task).filter_by(owner=user)
-        .options(selectinload(Task.comments))
-        .options(joinedload(Task.file))
-        .options(joinedload(Task.owner))
+        select(Task)
+        .join(EmailNotification, EmailNotification.task_id == Task.id)
+        .where(EmailNotification.user_id == user.id)
     )
-    if task_filter:
-        query = query.filter(Task.headline.icontains(task_filter))
     if task_status:
-        query = query.filter_by(status=task_status)
-    result = await session.execute(query)
-    tasks = result.scalars().all()
-    return tasks
+        query = query.filter(Task.status == task_status)
+    key = f"tasks:{await cache.generation('tasks')}:watching:{user.id}:{request.url.query}"
+    return await cached_json(
+        request, "tasks", "tasks", key,
+        lambda session: get_task_page(query, session, task_filter, cursor, limit, summary),
+        session,
+    )
+
+
+@router.get("/stats", response_model=TaskStats)
+async def get_task_stats(
+        request: Request,
+        owners: int = Query(20, ge=0, le=MAX_PAGE_SIZE),
+        days: int = Query(30, ge=1, le=366),
+        session: AsyncSession = Depends(get_read_session),
+        ):
+    async def render(session):
+        stats = await get_stats(session, owners, days)
+        return stats.model_dump_json().encode()
+
+    key = f"stats:{await cache.generation('tasks')}:{request.url.query}"
+    return await cached_json(request, "stats", "tasks", key, render, session)
 
 
 @router.get("/{task_id}", response_model=TaskRel)
-async def get_one_task(task_id: int, session: AsyncSession = Depends(get_async_session)):
-    try:
-        query = (
-            select(Task)
-            .filter_by(id=task_id)
-            .options(selectinload(Task.comments))
-            .options(joinedload(Task.file))
-            .options(joinedload(Task.owner))
-        )
-        result = await session.execute(query)
-        task = result.scalars().one()
-        return task
-    except NoResultFound:
-        raise HTTPException(status_code=404, detail="Item not found")
+async def get_one_task(task_id: int, request: Request, session: AsyncSession = Depends(get_read_session)):
+    async def render(session):
+        result = await session.execute(project_tasks(select(Task).filter_by(id=task_id)))
+        rows = result.all()
+        if not rows:
+            raise HTTPException(status_code=404, detail="Item not found")
+        [task] = await task_records(session, rows, with_comments=True)
+        return task_rel.dump_json(task_rel.validate_python(task))
+
+    key = f"task:{task_id}:{await cache.generation(f'task:{task_id}')}"
+    return await cached_json(request, "task", f"task:{task_id}", key, render, session)
 
 
-@router.delete("/{task_id}")
+@router.delete("/{task_id}", dependencies=[Depends(write_limit)])
 async def get_one_task(task_id: int,
                        session: AsyncSession = Depends(get_async_session),
+                       tasks: TaskRepository = Depends(get_task_repository),
                        user: User = Depends(current_active_user)):
     if not user.is_superuser:
         raise HTTPException(status_code=403, detail="Not authorized to delete task")
-    try:
-        query = delete(Task).where(Task.id == task_id)
-        await session.execute(query)
-        await session.commit()
-        return {"Message": "Task deleted"}
-    except NoResultFound:
+    task = await tasks.delete(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Item not found")
+    await count_task(session, task.owner_id, task.status, -1)
+    await session.commit()
+    await invalidate_task(task_id)
+    return {"Message": "Task deleted"}
 
 
-@router.post("/")
+@router.post("/", dependencies=[Depends(write_limit)])
 async def add_task(
         new_task: TaskAdd,
-        background_tasks: BackgroundTasks,
         session: AsyncSession = Depends(get_async_session),
         user: User = Depends(current_active_user),
         ):
-    new_task_db = Task(**new_task.dict(), owner=user)
+    new_task_db = Task(**new_task.dict(), owner_id=user.id)
     session.add(new_task_db)
     await session.flush()
-    new_notification = EmailNotification(email=user.email, task_id=new_task_db.id)
-    session.add(new_notification)
+    session.add(EmailNotification(task_id=new_task_db.id, user_id=user.id))
+    await count_task(session, user.id, TaskStatus.open, 1)
+    await count_day(session, created=1)
+    enqueue_notification(session, new_task_db.id, NotificationEvent.created)
     await session.commit()
-    background_tasks.add_task(send_email_notification, new_task_db.id, [user.email], session)
+    await cache.invalidate("tasks")
     return {"status": "OK"}
 
 
-@router.post("/{task_id}/comment")
+@router.post("/{task_id}/comment", dependencies=[Depends(write_limit)])
 async def add_comment(
         new_comment: CommentAdd,
-        background_tasks: BackgroundTasks,
         session: AsyncSession = Depends(get_async_session),
+        tasks: TaskRepository = Depends(get_task_repository),
         user: User = Depends(current_active_user)):
-    try:
-        query = (
-            select(Task)
-            .filter_by(id=new_comment.task_id)
-            .options(selectinload(Task.emails))
-        )
-        result = await session.execute(query)
-        task = result.scalars().one()
-    except NoResultFound:
+    task = await tasks.state(new_comment.task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     if task.status == TaskStatus.closed:
         raise HTTPException(status_code=403, detail="Task is closed")
 
-    new_comment_db = Comment(**new_comment.dict(), owner=user)
-    email_list = [row.email for row in task.emails]
-    if user.email not in email_list:
-        new_notification = EmailNotification(email=user.email, task_id=new_comment_db.task_id)
-        email_list.append(user.email)
-        session.add(new_notification)
+    new_comment_db = Comment(**new_comment.dict(), owner_id=user.id)
+    await subscribe(session, new_comment_db.task_id, user.id)
     session.add(new_comment_db)
-    background_tasks.add_task(send_email_notification, new_comment_db.task_id, email_list, session)
+    await tasks.touch(task.id, comments=1)
+    await count_day(session, comments=1)
+    enqueue_notification(session, new_comment_db.task_id, NotificationEvent.commented)
     await session.commit()
+    await invalidate_task(new_comment_db.task_id)
     return {"status": "OK"}
 
 
-@router.post("/{task_id}/close")
+@router.post("/{task_id}/close", dependencies=[Depends(write_limit)])
 async def close_task(
         task_id: int,
-        background_tasks: BackgroundTasks,
         session: AsyncSession = Depends(get_async_session),
+        tasks: TaskRepository = Depends(get_task_repository),
         user: User = Depends(current_active_user)):
-    try:
-        query = (
-            select(Task)
-            .filter_by(id=task_id)
-            .options(selectinload(Task.emails))
-        )
-        result = await session.execute(query)
-        task = result.scalars().one()
-    except NoResultFound:
+    # locked so two concurrent closes count the task once
+    task = await tasks.state(task_id, lock=True)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     if task.owner_id != user.id:
         raise HTTPException(status_code=403, detail="You cannot close this task")
 
-    email_list = [row.email for row in task.emails]
-    task.status = TaskStatus.closed
-    session.add(task)
-    background_tasks.add_task(send_email_notification, task_id, email_list, session)
+    if task.status != TaskStatus.closed:
+        await count_task(session, task.owner_id, TaskStatus.open, -1)
+        await count_task(session, task.owner_id, TaskStatus.closed, 1)
+        await count_day(session, closed=1)
+    await tasks.close(task_id)
+    enqueue_notification(session, task_id, NotificationEvent.closed)
     await session.commit()
+    await invalidate_task(task_id)
     return {"status": "OK"}
 
 
-@router.get("/{task_id}/comments", response_model=List[CommentRel])
-async def get_comments_from_specified_task(task_id: int, session: AsyncSession = Depends(get_async_session)):
-    try:
-        query = (
-            select(Task)
-            .filter_by(id=task_id)
-            .options(selectinload(Task.comments))
-        )
+@router.get("/{task_id}/comments", response_model=CommentPage)
+async def get_comments_from_specified_task(
+        task_id: int,
+        request: Request,
+        cursor: str = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        session: AsyncSession = Depends(get_read_session)):
+    async def render(session):
+        query = project_comments(select(Comment).filter_by(task_id=task_id))
+        query = keyset(query, Comment.created_at, Comment.id, cursor, limit, descending=False)
         result = await session.execute(query)
-        task = result.scalars().one()
-        return task.comments
-    except NoResultFound:
-        raise HTTPException(status_code=404, detail="Task not found")
+        rows, next_cursor = split_page(result.all(), limit)
+        if not rows and await session.scalar(select(Task.id).filter_by(id=task_id)) is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        items = [comment_record(row) for row in rows]
+        return comment_page.dump_json(comment_page.validate_python({"items": items, "next_cursor": next_cursor}))
+
+    key = f"task:{task_id}:comments:{await cache.generation(f'task:{task_id}')}:{request.url.query}"
+    return await cached_json(request, "comments", f"task:{task_id}", key, render, session)
+
 
+UPLOAD_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+                "required": ["file"],
+            },
+        },
+    },
+}
 
-@router.post("/upload", summary="Upload your Task file")
+
+@router.post(
+    "/upload",
+    summary="Upload your Task file",
+    dependencies=[Depends(check_upload_size), Depends(write_limit)],
+    openapi_extra={"requestBody": UPLOAD_BODY},
+)
 async def upload(
         task_id: int,
-        background_tasks: BackgroundTasks,
+        request: Request,
         session: AsyncSession = Depends(get_async_session),
-        file: UploadFile = File(...),
+        tasks: TaskRepository = Depends(get_task_repository),
         user: User = Depends(current_active_user)):
-    try:
-        query = (
-            select(Task)
-            .filter_by(id=task_id)
-            .options(selectinload(Task.emails))
-        )
-        result = await session.execute(query)
-        task = result.scalars().one()
-    except NoResultFound:
+    # the body is read here rather than declared as a File parameter, which FastAPI
+    # parses before any dependency runs: rate limited and unknown-task requests stop unread
+    if not await tasks.exists(task_id):
         raise HTTPException(status_code=404, detail="Task not found")
-    with open(f"static/taskfiles/{file.filename}", "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    mimetype = file.content_type
-    name = file.filename
+    # end the check's transaction, the connection goes back to the pool while the client sends;
+    # the rollback expires the loaded user, so its id is read first
+    owner_id = user.id
+    await session.rollback()
+    sha256, size, name, mimetype = await receive_upload(request)
 
-    taskfile = TaskFile(name=name, minetype=mimetype, task_id=task_id, owner=user)
-    email_list = [row.email for row in task.emails]
-    if user.email not in email_list:
-        email_list.append(user.email)
+    previews = await tasks.derived_previews(sha256)
+    taskfile = TaskFile(
+        name=name, minetype=mimetype, sha256=sha256, size=size, previews=previews, task_id=task_id, owner_id=owner_id
+    )
+    await subscribe(session, task_id, owner_id)
     session.add(taskfile)
+    await tasks.touch(task_id)
+    enqueue_notification(session, task_id, NotificationEvent.uploaded)
     await session.commit()
-    background_tasks.add_task(send_email_notification, task_id, email_list, session)
+    await invalidate_task(task_id)
+    if previews is None:
+        # thumbnails, previews and text are made in the background, the upload doesn't wait;
+        # when too many are queued they are made on first view instead
+        schedule_previews(sha256, mimetype)
     return f"{name} has been Successfully Uploaded"
 
 
-@router.post("/download", summary="Download file for Task")
+@router.get("/{task_id}/files", response_model=list[TaskFileRead])
+async def get_task_files(
+        task_id: int,
+        request: Request,
+        session: AsyncSession = Depends(get_read_session),
+        user: User = Depends(current_active_user)):
+    async def render(session):
+        tasks = TaskRepository(session)
+        files = await tasks.files(task_id)
+        if not files and not await tasks.exists(task_id):
+            raise HTTPException(status_code=404, detail="Task not found")
+        return file_list.dump_json(file_list.validate_python(files))
+
+    key = f"task:{task_id}:files:{await cache.generation(f'task:{task_id}')}"
+    return await cached_json(request, "files", f"task:{task_id}", key, render, session)
+
+
+@router.get(
+    "/{task_id}/files/{file_id}",
+    summary="Download a file of the Task",
+    dependencies=[Depends(download_limit)],
+)
+async def download_file(
+        task_id: int,
+        file_id: int,
+        request: Request,
+        tasks: TaskRepository = Depends(get_read_task_repository),
+        user: User = Depends(current_active_user)):
+    taskfile = await tasks.file(task_id, file_id)
+    if taskfile is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return await storage.response(request, taskfile)
+
+
+@router.get(
+    "/{task_id}/files/{file_id}/{kind}",
+    summary="Thumbnail, preview or text of a Task file",
+    dependencies=[Depends(download_limit)],
+)
+async def get_file_preview(
+        task_id: int,
+        file_id: int,
+        kind: PreviewKind,
+        request: Request,
+        tasks: TaskRepository = Depends(get_read_task_repository),
+        user: User = Depends(current_active_user)):
+    taskfile = await tasks.file(task_id, file_id)
+    if taskfile is None or not taskfile.sha256:
+        raise HTTPException(status_code=404, detail="File not found")
+    # a derivation can take seconds, don't hold a pooled connection while waiting for it;
+    # closing detaches taskfile with its columns loaded
+    await tasks.session.close()
+    if kind.value not in await ensure_previews(taskfile):
+        raise HTTPException(status_code=404, detail="Preview not available")
+    return await preview_response(request, taskfile, kind)
+
+
+@router.get(
+    "/{task_id}/download",
+    summary="Download the latest file of the Task",
+    dependencies=[Depends(download_limit)],
+)
 async def download(
         task_id: int,
-        background_tasks: BackgroundTasks,
-        session: AsyncSession = Depends(get_async_session),
+        request: Request,
+        tasks: TaskRepository = Depends(get_read_task_repository),
         user: User = Depends(current_active_user)):
-    try:
-        query = (
-            select(Task)
-            .filter_by(id=task_id)
-            .options(joinedload(Task.file))
-            .options(selectinload(Task.emails))
-        )
-        result = await session.execute(query)
-        task = result.scalars().one()
-    except NoResultFound:
-        raise HTTPException(status_code=404, detail="Task not found")
-    path = f"static/taskfiles/{task.file.name}"
-    email_list = [row.email for row in task.emails]
-    if user.email not in email_list:
-        email_list.append(user.email)
-    background_tasks.add_task(send_email_notification, task_id, email_list, session)
-    return FileResponse(path, media_type='application/octet-stream', filename=task.file.name)
+    taskfile = await tasks.latest_file(task_id)
+    if taskfile is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return await storage.response(request, taskfile)
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, date
 from .models import TaskStatus
 from pydantic import BaseModel
 
@@ -22,6 +22,20 @@ class TaskRead(TaskAdd):
     id: int
     status: TaskStatus
     created_at: datetime
+    comment_count: int = 0
+    last_activity_at: datetime | None = None
+
+
+class CommentImport(BaseModel):
+    text: str
+    created_at: datetime | None = None
+
+
+class TaskImport(TaskAdd):
+    status: TaskStatus = TaskStatus.open
+    created_at: datetime | None = None
+    comments: list[CommentImport] = []
+    watchers: list[str] = []
 
 
 class TaskFileAdd(BaseModel):
@@ -32,6 +46,10 @@ class TaskFileAdd(BaseModel):
 
 class TaskFileRead(TaskFileAdd):
     id: int
+    size: int | None = None
+    sha256: str | None = None
+    created_at: datetime | None = None
+    previews: list[str] | None = None
 
 
 from auth.schemas import UserRead
@@ -49,10 +67,50 @@ class CommentRel(CommentRead):
 
 class TaskRel(TaskRead):
     comments: list["CommentRel"]
-    file: TaskFileRead | None
+    files: list[TaskFileRead]
     owner: "UserRead"
 
 
+class TaskSummary(TaskRead):
+    files: list[TaskFileRead]
+    owner: "UserRead"
+
+
+class TaskPage(BaseModel):
+    items: list["TaskRel"]
+    next_cursor: str | None = None
+
+
+class TaskSummaryPage(BaseModel):
+    items: list["TaskSummary"]
+    next_cursor: str | None = None
+
+
+class CommentPage(BaseModel):
+    items: list["CommentRel"]
+    next_cursor: str | None = None
+
+
+class OwnerStats(BaseModel):
+    owner_id: int
+    username: str
+    open: int
+    closed: int
+
+
+class DayStats(BaseModel):
+    day: date
+    created: int
+    closed: int
+    comments: int
+
+
+class TaskStats(BaseModel):
+    open: int
+    closed: int
+    owners: list[OwnerStats]
+    days: list[DayStats]
+
 
 #
 # class Comment(BaseModel):
@@ -0,0 +1,44 @@
+import re
+
+from sqlalchemy import Select, select, union_all, func, false
+
+from .models import Task, Comment, SEARCH_CONFIG, comment_search_vector
+
+# a hit in the comments counts for less than one in the task itself
+COMMENT_WEIGHT = 0.5
+
+WORD = re.compile(r"\w+")
+
+
+def build_tsquery(phrase: str) -> str | None:
+    words = WORD.findall(phrase)
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def search_tasks(query: Select, phrase: str) -> Select:
+    tsquery = build_tsquery(phrase)
+    if tsquery is None:
+        return query.where(false())
+    ts_query = func.to_tsquery(SEARCH_CONFIG, tsquery)
+    hits = union_all(
+        select(
+            Task.id.label("task_id"),
+            func.ts_rank(Task.search_vector, ts_query).label("rank"),
+        ).where(Task.search_vector.op("@@")(ts_query)),
+        select(
+            Comment.task_id.label("task_id"),
+            (func.ts_rank(comment_search_vector, ts_query) * COMMENT_WEIGHT).label("rank"),
+        ).where(comment_search_vector.op("@@")(ts_query)),
+    ).subquery()
+    ranked = (
+        select(hits.c.task_id, func.max(hits.c.rank).label("rank"))
+        .group_by(hits.c.task_id)
+        .subquery()
+    )
+    return (
+        query
+        .join(ranked, ranked.c.task_id == Task.id)
+        .order_by(ranked.c.rank.desc(), Task.id.desc())
+    )
@@ -1,66 +1,184 @@
-import os
+import asyncio
+import base64
 import smtplib
 import ssl
+from collections import OrderedDict
 
-from email import encoders
+from email import policy
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload, joinedload
-from config import EMAIL, EMAIL_PASSWORD, DEBAG
-from tasks.models import Task
+from config import (
+    EMAIL, EMAIL_PASSWORD, DEBAG, SMTP_HOST, SMTP_PORT, SMTP_SSL, SMTP_POOL_SIZE, EMAIL_ATTACHMENTS_MAX_SIZE,
+    PUBLIC_URL,
+)
+from tasks.models import DigestItem
+from tasks.schemas import TaskRel, TaskFileRead
+from tasks.storage import storage, file_key
 
-SMTP_SERVER = "smtp.gmail.com"
-PORT = 465
+ATTACHMENT_CHUNK = 57 * 1024
+RENDER_CACHE_SIZE = 16
 
-if not DEBAG:
-    async def send_email_notification(task_id: int, email_list: list[str], session: AsyncSession):
-        query = (
-            select(Task)
-            .filter_by(id=task_id)
-            .options(selectinload(Task.comments))
-            .options(joinedload(Task.file))
-            .options(joinedload(Task.owner))
-        )
-        result = await session.execute(query)
-        task = result.scalars().one()
-        subject = task.headline
-        body = f"{task.description}\nfrom user {task.owner.username}\n"
-        if task.comments:
-            body += "Comments:\n"
-            body += "\n".join(f"{c.text} from user {c.owner.username}" for c in task.comments)
-
-
-        message = MIMEMultipart()
-        message["From"] = EMAIL
-        message["Subject"] = subject
-
-        message.attach(MIMEText(body, "plain"))
-        if task.file:
-            filename = f"static/taskfiles/{task.file.name}"
-
-            with open(filename, "rb") as attachment:
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(attachment.read())
-
-            encoders.encode_base64(part)
-
-            part.add_header(
-                "Content-Disposition",
-                f"attachment; filename= {filename}",
-            )
-            message.attach(part)
-
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL(SMTP_SERVER, PORT, context=context) as server:
+# rendered messages by event, so a retried event is not rendered again
+rendered_messages: OrderedDict[object, bytes] = OrderedDict()
+
+
+def encode_attachment(key: str) -> str:
+    # 57 raw bytes make one 76 character base64 line, so chunks stay line aligned
+    lines = []
+    with storage.open(key) as attachment:
+        while chunk := attachment.read(ATTACHMENT_CHUNK):
+            lines.append(base64.encodebytes(chunk).decode("ascii"))
+    return "".join(lines)
+
+
+def split_attachments(task: TaskRel) -> tuple[list[TaskFileRead], list[TaskFileRead]]:
+    # the newest files, usually the one the event is about, are attached while they fit;
+    # files of unknown size (uploaded before sizes were stored) are only linked
+    attached, linked = [], []
+    total = 0
+    for taskfile in sorted(task.files, key=lambda taskfile: taskfile.id, reverse=True):
+        if taskfile.size is not None and total + taskfile.size <= EMAIL_ATTACHMENTS_MAX_SIZE:
+            total += taskfile.size
+            attached.append(taskfile)
+        else:
+            linked.append(taskfile)
+    return attached, linked
+
+
+def build_message(task: TaskRel) -> MIMEMultipart:
+    subject = task.headline
+    body = f"{task.description}\nfrom user {task.owner.username}\n"
+    if task.comments:
+        body += "Comments:\n"
+        body += "\n".join(f"{c.text} from user {c.owner.username}" for c in task.comments)
+    attached, linked = split_attachments(task)
+    if linked:
+        body += "\nFiles:\n"
+        body += "\n".join(f"{f.name}: {PUBLIC_URL}/tasks/{task.id}/files/{f.id}" for f in linked)
+
+    message = MIMEMultipart(policy=policy.SMTP)
+    message["From"] = EMAIL
+    message["To"] = "undisclosed-recipients:;"
+    message["Subject"] = subject
+
+    message.attach(MIMEText(body, "plain", "utf-8", policy=policy.SMTP))
+    for taskfile in attached:
+        part = MIMEBase("application", "octet-stream", policy=policy.SMTP)
+        part.set_payload(encode_attachment(file_key(taskfile)))
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", "attachment", filename=taskfile.name)
+        message.attach(part)
+    return message
+
+
+def build_digest(items: list[DigestItem], headlines: dict[int, str]) -> MIMEText:
+    by_task: dict[int, list[DigestItem]] = {}
+    for item in items:
+        by_task.setdefault(item.task_id, []).append(item)
+    lines = []
+    for task_id, task_items in by_task.items():
+        lines.append(f"#{task_id} {headlines.get(task_id, '')}")
+        lines.extend(f"  {item.created_at:%Y-%m-%d %H:%M} {item.event.value}" for item in task_items)
+    message = MIMEText("\n".join(lines) + "\n", "plain", "utf-8", policy=policy.SMTP)
+    message["From"] = EMAIL
+    message["Subject"] = f"{len(items)} updates in {len(by_task)} tasks"
+    return message
+
+
+def render_message(key, task: TaskRel) -> bytes:
+    if key is None:
+        return build_message(task).as_bytes()
+    rendered = rendered_messages.pop(key, None)
+    if rendered is None:
+        rendered = build_message(task).as_bytes()
+    rendered_messages[key] = rendered
+    while len(rendered_messages) > RENDER_CACHE_SIZE:
+        rendered_messages.popitem(last=False)
+    return rendered
+
+
+class SMTPConnection:
+    def __init__(self):
+        self.server = None
+
+    def connect(self):
+        if SMTP_SSL:
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=ssl.create_default_context())
+        else:
+            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+        if EMAIL_PASSWORD:
             server.login(EMAIL, EMAIL_PASSWORD)
-            for receiver_email in email_list:
-                message["To"] = receiver_email
-                text = message.as_string()
-                server.sendmail(EMAIL, receiver_email, text)
+        self.server = server
+
+    def sendmail(self, sender: str, receivers: str | list[str], text: str | bytes):
+        if self.server is None:
+            self.connect()
+        try:
+            self.server.sendmail(sender, receivers, text)
+        except smtplib.SMTPServerDisconnected:
+            # the server dropped an idle connection, reconnect once
+            self.connect()
+            self.server.sendmail(sender, receivers, text)
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except smtplib.SMTPException:
+                pass
+            self.server = None
+
+
+class SMTPPool:
+    def __init__(self, size: int = SMTP_POOL_SIZE):
+        self.size = size
+        self.created = 0
+        self.idle: asyncio.Queue[SMTPConnection] = asyncio.Queue()
+
+    async def acquire(self) -> SMTPConnection:
+        if self.idle.empty() and self.created < self.size:
+            self.created += 1
+            return SMTPConnection()
+        return await self.idle.get()
+
+    def release(self, connection: SMTPConnection):
+        self.idle.put_nowait(connection)
+
+    async def close(self):
+        while not self.idle.empty():
+            await asyncio.to_thread(self.idle.get_nowait().close)
+        self.created = 0
+
+
+async def send(pool: SMTPPool, email_list: list[str], text: bytes):
+    connection = await pool.acquire()
+    try:
+        await asyncio.to_thread(connection.sendmail, EMAIL, email_list, text)
+    except Exception:
+        await asyncio.to_thread(connection.close)
+        raise
+    finally:
+        pool.release(connection)
+
+
+if not DEBAG:
+    async def send_email_notification(task: TaskRel, email_list: list[str], pool: SMTPPool, key=None):
+        if not email_list:
+            return
+        # one envelope for all watchers, the message is the same for everyone
+        # attachments are read from the storage, which may be a network call
+        await send(pool, email_list, await asyncio.to_thread(render_message, key, task))
+        rendered_messages.pop(key, None)
+
+    async def send_digest(email: str, items: list[DigestItem], headlines: dict[int, str], pool: SMTPPool):
+        message = build_digest(items, headlines)
+        message["To"] = email
+        await send(pool, [email], message.as_bytes())
 else:
-    async def send_email_notification(task_id: int, email_list: list[str], session: AsyncSession):
+    async def send_email_notification(task: TaskRel, email_list: list[str], pool: SMTPPool, key=None):
+        pass
+
+    async def send_digest(email: str, items: list[DigestItem], headlines: dict[int, str], pool: SMTPPool):
         pass
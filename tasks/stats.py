@@ -0,0 +1,156 @@
+import asyncio
+import random
+from datetime import timedelta
+
+from sqlalchemy import select, delete, func, cast, Date, literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth.models import User
+from config import STATS_SHARDS
+from database import async_session_maker
+from .models import Task, Comment, TaskStatus, TaskStatusCount, OwnerTaskCount, DailyTaskCount, utcnow
+from .schemas import TaskStats, OwnerStats, DayStats
+
+today = cast(utcnow, Date)
+
+
+async def count_task(session: AsyncSession, owner_id: int | None, status: TaskStatus, delta: int):
+    # runs in the caller's transaction, so the counters move together with the task
+    await session.execute(
+        insert(TaskStatusCount)
+        .values(status=status, shard=random.randrange(STATS_SHARDS), count=delta)
+        .on_conflict_do_update(
+            index_elements=["status", "shard"],
+            set_={"count": TaskStatusCount.count + delta},
+        )
+    )
+    if owner_id is not None:
+        await session.execute(
+            insert(OwnerTaskCount)
+            .values(owner_id=owner_id, status=status, count=delta)
+            .on_conflict_do_update(
+                index_elements=["owner_id", "status"],
+                set_={"count": OwnerTaskCount.count + delta},
+            )
+        )
+
+
+async def count_day(session: AsyncSession, day=today, created: int = 0, closed: int = 0, comments: int = 0):
+    await session.execute(
+        insert(DailyTaskCount)
+        .values(day=day, shard=random.randrange(STATS_SHARDS), created=created, closed=closed, comments=comments)
+        .on_conflict_do_update(
+            index_elements=["day", "shard"],
+            set_={
+                "created": DailyTaskCount.created + created,
+                "closed": DailyTaskCount.closed + closed,
+                "comments": DailyTaskCount.comments + comments,
+            },
+        )
+    )
+
+
+async def get_stats(session: AsyncSession, owners: int, days: int) -> TaskStats:
+    result = await session.execute(
+        select(TaskStatusCount.status, func.sum(TaskStatusCount.count))
+        .group_by(TaskStatusCount.status)
+    )
+    by_status = dict(result.tuples().all())
+
+    result = await session.execute(
+        select(OwnerTaskCount.owner_id, User.username, OwnerTaskCount.count)
+        .join(User, User.id == OwnerTaskCount.owner_id)
+        .where(OwnerTaskCount.status == TaskStatus.open)
+        .order_by(OwnerTaskCount.count.desc())
+        .limit(owners)
+    )
+    top = result.all()
+    result = await session.execute(
+        select(OwnerTaskCount.owner_id, OwnerTaskCount.count)
+        .where(OwnerTaskCount.status == TaskStatus.closed)
+        .where(OwnerTaskCount.owner_id.in_([row.owner_id for row in top]))
+    )
+    closed = dict(result.tuples().all())
+
+    result = await session.execute(
+        select(
+            DailyTaskCount.day,
+            func.sum(DailyTaskCount.created),
+            func.sum(DailyTaskCount.closed),
+            func.sum(DailyTaskCount.comments),
+        )
+        .where(DailyTaskCount.day > today - timedelta(days=days))
+        .group_by(DailyTaskCount.day)
+        .order_by(DailyTaskCount.day)
+    )
+    return TaskStats(
+        open=by_status.get(TaskStatus.open, 0),
+        closed=by_status.get(TaskStatus.closed, 0),
+        owners=[
+            OwnerStats(owner_id=row.owner_id, username=row.username, open=row.count, closed=closed.get(row.owner_id, 0))
+            for row in top
+        ],
+        days=[
+            DayStats(day=day, created=created, closed=closed_count, comments=comments)
+            for day, created, closed_count, comments in result.tuples()
+        ],
+    )
+
+
+async def rebuild(session: AsyncSession):
+    # recount from scratch, for data written around the handlers (COPY, admin panel)
+    await session.execute(delete(TaskStatusCount))
+    await session.execute(delete(OwnerTaskCount))
+    await session.execute(delete(DailyTaskCount))
+    await session.execute(
+        insert(TaskStatusCount).from_select(
+            ["status", "shard", "count"],
+            select(Task.status, literal_column("0"), func.count()).group_by(Task.status),
+        )
+    )
+    await session.execute(
+        insert(OwnerTaskCount).from_select(
+            ["owner_id", "status", "count"],
+            select(Task.owner_id, Task.status, func.count())
+            .where(Task.owner_id.is_not(None))
+            .group_by(Task.owner_id, Task.status),
+        )
+    )
+    # closing time isn't stored, so rebuilt history counts closures on the last activity day
+    tasks = (
+        select(
+            cast(Task.created_at, Date).label("day"),
+            literal_column("1").label("created"),
+            literal_column("0").label("closed"),
+            literal_column("0").label("comments"),
+        )
+        .union_all(
+            select(cast(Task.last_activity_at, Date), literal_column("0"), literal_column("1"), literal_column("0"))
+            .where(Task.status == TaskStatus.closed),
+            select(cast(Comment.created_at, Date), literal_column("0"), literal_column("0"), literal_column("1")),
+        )
+        .subquery()
+    )
+    await session.execute(
+        insert(DailyTaskCount).from_select(
+            ["day", "shard", "created", "closed", "comments"],
+            select(
+                tasks.c.day,
+                literal_column("0"),
+                func.sum(tasks.c.created),
+                func.sum(tasks.c.closed),
+                func.sum(tasks.c.comments),
+            ).group_by(tasks.c.day),
+        )
+    )
+
+
+async def main():
+    async with async_session_maker() as session:
+        await rebuild(session)
+        await session.commit()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
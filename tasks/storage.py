@@ -0,0 +1,395 @@
+from abc import ABC, abstractmethod
+import asyncio
+import hashlib
+import importlib
+import os
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, NamedTuple
+from urllib.parse import quote
+
+import aiofiles
+import aiofiles.os
+import anyio
+from fastapi import HTTPException
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy import select, update
+from starlette.requests import Request
+from starlette.responses import RedirectResponse, Response
+
+from config import (
+    TASKFILES_DIR, MAX_UPLOAD_SIZE, STORAGE_BACKEND, S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION,
+    S3_ACCESS_KEY, S3_SECRET_KEY, S3_URL_TTL,
+)
+from .models import TaskFile
+from .responses import file_response
+from .schemas import TaskFileRead
+
+CHUNK_SIZE = 1024 * 1024
+# room for the multipart boundaries and part headers around the file
+UPLOAD_OVERHEAD = 64 * 1024
+MAX_FILENAME = TaskFile.__table__.c.name.type.length
+MAX_MEDIA_TYPE = TaskFile.__table__.c.minetype.type.length
+DEFAULT_MEDIA_TYPE = "application/octet-stream"
+
+
+def content_key(sha256: str) -> str:
+    # sharded by the first byte of the hash, so no directory or prefix holds every file
+    return f"{sha256[:2]}/{sha256}"
+
+
+def file_key(taskfile: TaskFile | TaskFileRead) -> str:
+    if taskfile.sha256:
+        return content_key(taskfile.sha256)
+    # uploaded before files were stored by hash
+    return taskfile.name
+
+
+class Storage(ABC):
+    # where file contents live; size and hash are kept in taskfiles, so listing never asks the storage.
+    # Another backend implements these and is set with STORAGE_BACKEND=module:Class
+    tmp_dir: str
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def put(self, path: str, key: str):
+        # takes over a finished temporary file
+        ...
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        # blocking, call it from a thread
+        ...
+
+    @abstractmethod
+    def local_copy(self, key: str) -> AsyncIterator[str]:
+        # async context manager giving a path on local disk, for tools that only read files
+        ...
+
+    @abstractmethod
+    async def serve(
+            self,
+            request: Request,
+            key: str,
+            filename: str,
+            media_type: str,
+            etag: str | None,
+            cache_control: str = "private, no-cache",
+            disposition: str = "attachment",
+            ) -> Response:
+        ...
+
+    async def response(self, request: Request, taskfile: TaskFile | TaskFileRead) -> Response:
+        etag = f'"{taskfile.sha256}"' if taskfile.sha256 else None
+        return await self.serve(
+            request, file_key(taskfile), taskfile.name, taskfile.minetype or "application/octet-stream", etag
+        )
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str = TASKFILES_DIR):
+        self.root = root
+        # on the same filesystem, so a finished upload is moved into place with a rename
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    async def exists(self, key: str) -> bool:
+        return await aiofiles.os.path.exists(self.path(key))
+
+    async def put(self, path: str, key: str):
+        target = self.path(key)
+        if await aiofiles.os.path.exists(target):
+            # same content is already stored, keep a single copy
+            await aiofiles.os.remove(path)
+        else:
+            await aiofiles.os.makedirs(os.path.dirname(target), exist_ok=True)
+            await aiofiles.os.replace(path, target)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[str]:
+        yield self.path(key)
+
+    async def serve(
+            self,
+            request: Request,
+            key: str,
+            filename: str,
+            media_type: str,
+            etag: str | None,
+            cache_control: str = "private, no-cache",
+            disposition: str = "attachment",
+            ) -> Response:
+        return await file_response(request, self.path(key), filename, etag, media_type, cache_control, disposition)
+
+
+class S3Storage(Storage):
+    # any S3 compatible service; S3_ENDPOINT_URL points it at MinIO or another local stand-in
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX):
+        import boto3  # only needed with STORAGE_BACKEND=s3
+
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            aws_access_key_id=S3_ACCESS_KEY,
+            aws_secret_access_key=S3_SECRET_KEY,
+        )
+        self.bucket = bucket
+        self.prefix = prefix
+        self.tmp_dir = os.path.join(tempfile.gettempdir(), "taskfiles")
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await anyio.to_thread.run_sync(
+                lambda: self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def put(self, path: str, key: str):
+        try:
+            if not await self.exists(key):
+                await anyio.to_thread.run_sync(self.client.upload_file, path, self.bucket, self.object_key(key))
+        finally:
+            await aiofiles.os.remove(path)
+
+    def open(self, key: str) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))["Body"]
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[str]:
+        await aiofiles.os.makedirs(self.tmp_dir, exist_ok=True)
+        path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            await anyio.to_thread.run_sync(self.client.download_file, self.bucket, self.object_key(key), path)
+            yield path
+        finally:
+            if await aiofiles.os.path.exists(path):
+                await aiofiles.os.remove(path)
+
+    async def serve(
+            self,
+            request: Request,
+            key: str,
+            filename: str,
+            media_type: str,
+            etag: str | None,
+            cache_control: str = "private, no-cache",
+            disposition: str = "attachment",
+            ) -> Response:
+        # the client downloads straight from the storage, which also answers Range and conditional requests.
+        # Objects are shared by content, so name and type come with the signed url
+        url = self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.object_key(key),
+                "ResponseContentType": media_type,
+                "ResponseContentDisposition": f"{disposition}; filename*=utf-8''{quote(filename)}",
+                "ResponseCacheControl": cache_control,
+            },
+            ExpiresIn=S3_URL_TTL,
+        )
+        return RedirectResponse(url, status_code=307, headers={"cache-control": "private, no-store"})
+
+
+def load_storage() -> Storage:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
+    module, _, name = STORAGE_BACKEND.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+
+storage = load_storage()
+
+
+def check_upload_size(request: Request):
+    # a dependency turning away a body declared too large before any of it is read;
+    # bodies sent without Content-Length are cut off by receive_upload
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > MAX_UPLOAD_SIZE + UPLOAD_OVERHEAD:
+        raise HTTPException(status_code=413, detail="File is too large")
+
+
+class Upload(NamedTuple):
+    sha256: str
+    size: int
+    filename: str
+    content_type: str
+
+
+def fit_filename(name: str) -> str:
+    # shortened to fit taskfiles.name before anything is stored, keeping the extension
+    if len(name) <= MAX_FILENAME:
+        return name
+    stem, ext = os.path.splitext(name)
+    if len(ext) >= MAX_FILENAME // 2:
+        stem, ext = name, ""
+    return stem[:MAX_FILENAME - len(ext)] + ext
+
+
+class UploadParser:
+    # parses a multipart body as it arrives: the file field is hashed, counted and written to a
+    # storage temp file chunk by chunk, so nothing is spooled beforehand and a body over
+    # MAX_UPLOAD_SIZE is cut off however it is sent
+    def __init__(self, field: str = "file"):
+        self.field = field
+        self.events: list[tuple[str, bytes]] = []
+        self.header_field = b""
+        self.header_value = b""
+        self.headers: dict[bytes, bytes] = {}
+        self.buffer = None
+        self.tmp_path: str | None = None
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.filename: str | None = None
+        self.content_type = DEFAULT_MEDIA_TYPE
+        self.done = False
+
+    # the parser calls these synchronously, the events are handled between chunks
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = self.header_value = b""
+
+    def on_headers_finished(self):
+        self.events.append(("headers", b""))
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        self.events.append(("data", data[start:end]))
+
+    def on_part_end(self):
+        self.events.append(("end", b""))
+
+    async def start_part(self):
+        headers, self.headers = self.headers, {}
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        if self.done or options.get(b"name") != self.field.encode() or b"filename" not in options:
+            return
+        self.filename = fit_filename(options[b"filename"].decode("utf-8", "replace"))
+        content_type = headers.get(b"content-type", b"").decode("latin-1").strip()
+        if content_type and len(content_type) <= MAX_MEDIA_TYPE:
+            self.content_type = content_type
+        await aiofiles.os.makedirs(storage.tmp_dir, exist_ok=True)
+        self.tmp_path = os.path.join(storage.tmp_dir, uuid.uuid4().hex)
+        self.buffer = await aiofiles.open(self.tmp_path, "wb")
+
+    async def handle_events(self):
+        events, self.events = self.events, []
+        for kind, data in events:
+            if kind == "headers":
+                await self.start_part()
+            elif self.buffer is None:
+                # other fields are skipped
+                continue
+            elif kind == "data":
+                self.size += len(data)
+                if self.size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=413, detail="File is too large")
+                self.digest.update(data)
+                await self.buffer.write(data)
+            else:
+                await self.buffer.close()
+                self.buffer = None
+                self.done = True
+
+    async def parse(self, request: Request) -> Upload:
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+            raise HTTPException(status_code=422, detail="A multipart/form-data body is required")
+        parser = MultipartParser(params[b"boundary"], {
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        })
+        try:
+            try:
+                async for chunk in request.stream():
+                    parser.write(chunk)
+                    await self.handle_events()
+                parser.finalize()
+                await self.handle_events()
+            except MultipartParseError:
+                raise HTTPException(status_code=400, detail="Malformed multipart body")
+            finally:
+                if self.buffer is not None:
+                    await self.buffer.close()
+            if not self.done:
+                raise HTTPException(status_code=422, detail="A file is required")
+            sha256 = self.digest.hexdigest()
+            await storage.put(self.tmp_path, content_key(sha256))
+        except BaseException:
+            if self.tmp_path is not None and await aiofiles.os.path.exists(self.tmp_path):
+                await aiofiles.os.remove(self.tmp_path)
+            raise
+        return Upload(sha256, self.size, self.filename, self.content_type)
+
+
+async def receive_upload(request: Request, field: str = "file") -> Upload:
+    return await UploadParser(field).parse(request)
+
+
+def copy_legacy_file(path: str, tmp_path: str) -> tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as source, open(tmp_path, "wb") as target:
+        while chunk := source.read(CHUNK_SIZE):
+            size += len(chunk)
+            digest.update(chunk)
+            target.write(chunk)
+    return digest.hexdigest(), size
+
+
+async def backfill():
+    # files uploaded before hashing lie flat in TASKFILES_DIR under their name:
+    # hash them, move them into the configured storage and record size and hash
+    from database import async_session_maker
+
+    os.makedirs(storage.tmp_dir, exist_ok=True)
+    async with async_session_maker() as session:
+        rows = (await session.execute(
+            select(TaskFile.id, TaskFile.name).where(TaskFile.sha256.is_(None)).order_by(TaskFile.id)
+        )).all()
+        for row in rows:
+            path = os.path.join(TASKFILES_DIR, row.name)
+            if not os.path.isfile(path):
+                print(f"missing {path} for file {row.id}")
+                continue
+            tmp_path = os.path.join(storage.tmp_dir, uuid.uuid4().hex)
+            sha256, size = await anyio.to_thread.run_sync(copy_legacy_file, path, tmp_path)
+            await storage.put(tmp_path, content_key(sha256))
+            await session.execute(update(TaskFile).where(TaskFile.id == row.id).values(sha256=sha256, size=size))
+            await session.commit()
+        print(f"{len(rows)} files without a hash processed")
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill())